@@ -0,0 +1,761 @@
+# Микробенчмарки горячих участков бота.
+# Запуск: python bench.py <имя> [параметры], список — python bench.py -h
+import argparse
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+# Как в replay.py: бот, которого создают бенчмарки, держит хранилища во временном
+# каталоге, а не рядом с настоящим развёртыванием в текущем каталоге
+BENCH_STATE = tempfile.TemporaryDirectory(prefix='newsbot-bench-')
+os.environ.update({
+    'SEEN_DB_PATH': os.path.join(BENCH_STATE.name, 'seen_news.sqlite3'),
+    'OUTBOX_DB_PATH': os.path.join(BENCH_STATE.name, 'outbox.sqlite3'),
+    'ARCHIVE_DB_PATH': os.path.join(BENCH_STATE.name, 'news_archive.sqlite3'),
+    'FEED_CACHE_PATH': os.path.join(BENCH_STATE.name, 'feed_cache.json'),
+    'MIRROR_HEALTH_PATH': os.path.join(BENCH_STATE.name, 'mirror_health.json'),
+})
+
+import bot_server
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss в Linux — килобайты, в macOS — байты
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def report(name: str, total_sec: float, ops: int):
+    print(f"{name:<32} {ops:>10} оп.  {total_sec * 1e6 / max(ops, 1):>9.2f} мкс/оп")
+
+
+# Закрывает хранилища бота так же, как main() при остановке
+async def close_bot(bot):
+    if bot.archive is not None:
+        await bot.archive.close()
+    bot.seen_news.close()
+    if bot.delivery.outbox is not None:
+        bot.delivery.outbox.close()
+
+
+def bench_dedup(args):
+    n = args.n
+    lookups = args.lookups
+    with tempfile.TemporaryDirectory() as tmp:
+        rss_before = max_rss_mb()
+        path = os.path.join(tmp, 'seen.sqlite3')
+        bloom_capacity = 0 if args.no_bloom else max(n, bot_server.SEEN_BLOOM_CAPACITY)
+        store = bot_server.SqliteSeenStore(path=path, bloom_capacity=bloom_capacity)
+        hashes = (bot_server.hashlib.md5(str(i).encode()).digest() for i in range(n))
+        # Часть записей — старше TTL: их вытеснит проход по TTL
+        expired_ts = time.time() - store.ttl - 60
+        expired = int(n * args.expired)
+        start = time.perf_counter()
+        batch = []
+        for i, h in enumerate(hashes):
+            batch.append(h)
+            if len(batch) == 10000 or i == expired - 1:
+                store.add_many(batch, expired_ts if i < expired else None)
+                batch = []
+        store.add_many(batch)
+        store.flush()
+        report('вставка', time.perf_counter() - start, n)
+
+        hits = [bot_server.hashlib.md5(str(i).encode()).digest() for i in range(expired, n, max((n - expired) // lookups, 1))]
+        misses = [bot_server.hashlib.md5(f"miss-{i}".encode()).digest() for i in range(lookups)]
+        start = time.perf_counter()
+        found = sum(1 for h in hits if h in store)
+        report('поиск (есть в индексе)', time.perf_counter() - start, len(hits))
+        start = time.perf_counter()
+        false_hits = sum(1 for h in misses if h in store)
+        report('поиск (нет в индексе)', time.perf_counter() - start, len(misses))
+        assert found == len(hits), 'часть вставленных хешей не найдена'
+        assert false_hits == 0, 'найдены хеши, которых не вставляли'
+
+        start = time.perf_counter()
+        evicted = store.evict_expired()
+        report(f'вытеснение по TTL ({evicted} записей)', time.perf_counter() - start, 1)
+        assert evicted == expired, 'вытеснены не все устаревшие записи'
+        store.close()
+
+        # Открытие заполненного хранилища: event loop ждёт только конструктор,
+        # Bloom-фильтр дочитывается в фоне
+        start = time.perf_counter()
+        store = bot_server.SqliteSeenStore(path=path, bloom_capacity=bloom_capacity)
+        report('открытие', time.perf_counter() - start, 1)
+        if bloom_capacity:
+            store.bloom_ready.wait()
+            report('загрузка Bloom-фильтра (в фоне)', time.perf_counter() - start, 1)
+        assert all(h in store for h in hits[:1000]), 'после открытия хеши не найдены'
+        print(f"записей: {len(store)}, файл: {os.path.getsize(store.path) / 1e6:.1f} МБ, "
+              f"пиковый RSS: {max_rss_mb():.1f} МБ (до: {rss_before:.1f} МБ)")
+        store.close()
+
+
+# Заголовки для бенчмарков: комбинации реальных шаблонов, чтобы не зависеть от сети
+HEADLINE_SUBJECTS = ['Сбербанк', 'Газпром', 'Лукойл', 'ЦБ РФ', 'Минфин', 'Норникель', 'Яндекс', 'Мосбиржа', 'ВТБ', 'Роснефть']
+HEADLINE_VERBS = ['повысил', 'снизил', 'сохранил', 'объявил', 'пересмотрел', 'опубликовал', 'увеличил', 'сократил']
+HEADLINE_OBJECTS = ['ключевую ставку', 'дивиденды', 'прогноз по инфляции', 'выручку за квартал', 'добычу нефти',
+                    'курс рубля', 'программу выкупа акций', 'кредитный портфель', 'инвестиционную программу']
+
+
+def synthetic_headlines(n: int, seed: int = 42) -> list:
+    rnd = random.Random(seed)
+    return [
+        f"{rnd.choice(HEADLINE_SUBJECTS)} {rnd.choice(HEADLINE_VERBS)} {rnd.choice(HEADLINE_OBJECTS)} на {rnd.randint(1, 99)}%"
+        for _ in range(n)
+    ]
+
+
+def load_whitelist() -> list:
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'news_filters.json'), encoding='utf-8') as f:
+        return json.load(f).get('whitelist', [])
+
+
+# Исходная реализация: полный проход Natasha по заголовку и каждому ключу на каждый вызов
+def legacy_normalize_text_natasha(text: str) -> set:
+    models = bot_server.nlp.ensure()
+    doc = models.Doc(text.lower())
+    doc.segment(models.segmenter)
+    doc.tag_morph(models.morph_tagger)
+    lemmas = set()
+    for token in doc.tokens:
+        token.lemmatize(models.morph_vocab)
+        if re.match(r'\w+', token.text):
+            lemmas.add(token.lemma)
+    return lemmas
+
+
+def legacy_match_with_synonyms(title: str, keywords: list) -> bool:
+    models = bot_server.nlp.ensure()
+    lemmas = legacy_normalize_text_natasha(title)
+    for keyword in keywords:
+        doc = models.Doc(keyword.lower())
+        doc.segment(models.segmenter)
+        doc.tag_morph(models.morph_tagger)
+        if doc.tokens:
+            doc.tokens[0].lemmatize(models.morph_vocab)
+            lemma = doc.tokens[0].lemma
+        else:
+            lemma = keyword.lower()
+        all_forms = {lemma} | set(bot_server.SYNONYMS.get(lemma, []))
+        if lemmas & all_forms:
+            return True
+    return False
+
+
+# Ключ из нескольких слов совпадает только целиком: (ключ, заголовок, по леммам, по подстроке)
+KEYWORD_PHRASE_CASES = [
+    ('ключевая ставка', 'Ключевые риски для экономики', False, False),
+    ('ключевая ставка', 'ЦБ сохранил ключевую ставку на уровне 21%', True, False),
+    ('ключевая ставка', 'Ключевая ставка останется на уровне 21%', True, True),
+    ('валютное регулирование', 'Валютный рынок открылся ростом', False, False),
+    ('валютное регулирование', 'ЦБ смягчил валютное регулирование для экспортёров', True, True),
+]
+
+
+def check_keyword_phrases(lemmatizer):
+    for keyword, title, by_lemmas, by_substring in KEYWORD_PHRASE_CASES:
+        compiled = lemmatizer.compile_keywords([keyword])
+        assert lemmatizer.match(lemmatizer.lemmatize(title), compiled) == by_lemmas, f'леммы: «{keyword}» / «{title}»'
+        assert bot_server.PhraseMatcher([keyword]).match(title) == by_substring, f'подстрока: «{keyword}» / «{title}»'
+    print(f"ключи из нескольких слов: {len(KEYWORD_PHRASE_CASES)} случаев совпали с ожиданием")
+
+
+def bench_lemmas(args):
+    bot_server.nlp.ensure()
+    keywords = load_whitelist()[:args.keywords]
+    titles = synthetic_headlines(args.n)
+    legacy_titles = titles[:args.legacy]
+    # Старая реализация брала только первое слово ключа, сверяемся с ней на однословных
+    single_words = [k for k in keywords if len(k.split()) == 1]
+
+    start = time.perf_counter()
+    legacy = [legacy_match_with_synonyms(t, single_words) for t in legacy_titles]
+    report('старый match_with_synonyms', time.perf_counter() - start, len(legacy_titles))
+
+    lemmatizer = bot_server.Lemmatizer()
+    start = time.perf_counter()
+    compiled = lemmatizer.compile_keywords(keywords)
+    report('компиляция ключей (один раз)', time.perf_counter() - start, len(keywords))
+
+    for label in ('пакет, холодный кеш', 'пакет, тёплый кеш'):
+        start = time.perf_counter()
+        lemmas = []
+        for i in range(0, len(titles), args.batch):
+            lemmas.extend(lemmatizer.lemmatize_batch(titles[i:i + args.batch]))
+        matched = [lemmatizer.match(l, compiled) for l in lemmas]
+        report(label, time.perf_counter() - start, len(titles))
+
+    compiled_single = lemmatizer.compile_keywords(single_words)
+    assert [lemmatizer.match(l, compiled_single) for l in lemmas[:len(legacy)]] == legacy, \
+        'результаты расходятся со старой реализацией'
+    check_keyword_phrases(lemmatizer)
+    keys = [bot_server.normalize_key(t) for t in legacy_titles]
+    single = [lemmatizer.lemmatize_uncached([k])[0] for k in keys]
+    assert lemmatizer.lemmatize_uncached(keys) == single, 'пакетная лемматизация расходится с поштучной'
+    print(f"совпадений: {sum(matched)}/{len(matched)}, кеш: {lemmatizer.hits} hit / {lemmatizer.misses} miss")
+
+
+def legacy_filter_and_priority(title, description, whitelist, blacklist, critical, companies, source_priority=3):
+    title_lower = title.lower()
+    if whitelist and not any(word.lower() in title_lower for word in whitelist):
+        return None
+    if blacklist and any(word.lower() in title_lower for word in blacklist):
+        return None
+    text = f"{title} {description}".lower()
+    for keyword in critical:
+        if keyword in text:
+            return 1
+    for company in companies:
+        if company in text:
+            return min(source_priority, 2)
+    return source_priority
+
+
+def matcher_filter_and_priority(matcher, title, description, has_whitelist, has_blacklist, source_priority=3):
+    mask = matcher.scan(title, matcher.bit('whitelist') | matcher.bit('blacklist'))
+    if has_whitelist and not mask & matcher.bit('whitelist'):
+        return None
+    if has_blacklist and mask & matcher.bit('blacklist'):
+        return None
+    mask = matcher.scan(f"{title} {description}", matcher.bit('critical') | matcher.bit('company'))
+    if mask & matcher.bit('critical'):
+        return 1
+    if mask & matcher.bit('company'):
+        return min(source_priority, 2)
+    return source_priority
+
+
+def bench_keywords(args):
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'news_filters.json'), encoding='utf-8') as f:
+        filters = json.load(f)
+    whitelist, blacklist = filters.get('whitelist', []), filters.get('blacklist', [])
+    critical = ['ключевая ставка', 'санкции', 'цб рф', 'банк россии', 'набиуллина', 'силуанов', 'курс рубля', 'золото']
+    rnd = random.Random(7)
+    titles = synthetic_headlines(args.n)
+    description = 'Компания сообщила о результатах за отчётный период, аналитики ожидают роста показателей. ' * 3
+
+    crossover = None
+    for count in args.companies:
+        # Синтетические тикеры и названия эмитентов; реальные — в конце списка, как при росте конфига
+        companies = [
+            ''.join(rnd.choice('абвгдеклмнопрстуфхя') for _ in range(rnd.randint(4, 10))) for _ in range(count)
+        ] + [w.lower() for w in HEADLINE_SUBJECTS]
+        categories = {'whitelist': whitelist, 'blacklist': blacklist, 'critical': critical, 'company': companies}
+        words = sum(len(v) for v in categories.values())
+        start = time.perf_counter()
+        legacy = [legacy_filter_and_priority(t, description, whitelist, blacklist, critical, companies) for t in titles]
+        report(f'старый поиск, {len(companies)} компаний', time.perf_counter() - start, len(titles))
+
+        per_title = {}
+        for label, linear in (('линейный', True), ('автомат', False)):
+            start = time.perf_counter()
+            matcher = bot_server.KeywordMatcher(categories, linear=linear)
+            report(f'сборка: {label}', time.perf_counter() - start, 1)
+            start = time.perf_counter()
+            fast = [matcher_filter_and_priority(matcher, t, description, bool(whitelist), bool(blacklist)) for t in titles]
+            per_title[linear] = time.perf_counter() - start
+            report(f'{label}, {words} слов', per_title[linear], len(titles))
+            assert fast == legacy, 'результаты расходятся со старым поиском'
+        chosen = 'линейный' if bot_server.KeywordMatcher(categories).linear else 'автомат'
+        print(f"  KeywordMatcher выбирает: {chosen}")
+        if crossover is None and per_title[False] < per_title[True]:
+            crossover = words
+    limit = bot_server.KeywordMatcher.LINEAR_MAX_WORDS
+    if crossover is None:
+        print(f"автомат не обогнал линейный поиск ни на одном размере; порог LINEAR_MAX_WORDS = {limit}")
+    else:
+        print(f"автомат быстрее линейного поиска начиная с ~{crossover} слов; порог LINEAR_MAX_WORDS = {limit}")
+
+
+# Лента в духе full.rss РБК: свежие записи сверху, у каждой полный текст статьи
+def synthetic_full_rss(items: int, body_kb: int, seed: int = 42) -> bytes:
+    now = datetime.now(timezone.utc)
+    paragraph = 'Аналитики отмечают, что рынок отреагировал на решение регулятора умеренным ростом. '
+    body = (paragraph * (body_kb * 1024 // len(paragraph.encode()) + 1))
+    parts = ['<?xml version="1.0" encoding="utf-8"?>\n<rss version="2.0" xmlns:rbc_news="https://www.rbc.ru">'
+             '<channel><title>РБК</title><link>https://www.rbc.ru</link>']
+    for i, title in enumerate(synthetic_headlines(items, seed)):
+        pub = format_datetime(now - timedelta(minutes=5 * i))
+        parts.append(
+            f'<item><title>{title}</title><link>https://www.rbc.ru/news/{seed}/{i}</link>'
+            f'<description>{title}. Подробности в материале.</description><pubDate>{pub}</pubDate>'
+            f'<rbc_news:full-text>{body}</rbc_news:full-text></item>'
+        )
+    parts.append('</channel></rss>')
+    return ''.join(parts).encode('utf-8')
+
+
+# Время и пиковая память меряем раздельно: tracemalloc сильно замедляет feedparser
+def measure(func, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    elapsed = (time.perf_counter() - start) / repeat
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def bench_stream(args):
+    if args.fixture:
+        with open(args.fixture, 'rb') as f:
+            data = f.read()
+    else:
+        data = synthetic_full_rss(args.items, args.body_kb)
+    limit = bot_server.FEED_MAX_ENTRIES
+    chunk = bot_server.STREAM_CHUNK_SIZE
+    print(f"лента: {len(data) / 1024:.0f} КБ, лимит записей: {limit}")
+
+    def buffered():
+        return [(e.get('title'), e.get('link')) for e in bot_server.feedparser.parse(data).entries[:limit]]
+
+    def streaming():
+        parser = bot_server.StreamingFeedParser()
+        entries = []
+        read = 0
+        for i in range(0, len(data), chunk):
+            read += len(data[i:i + chunk])
+            entries.extend(parser.feed(data[i:i + chunk]))
+            if len(entries) >= limit:
+                break
+        else:
+            entries.extend(parser.close())
+        return [(e['title'], e['link']) for e in entries[:limit]], read
+
+    old, old_sec, old_peak = measure(buffered, args.repeat)
+    (new, read), new_sec, new_peak = measure(streaming, args.repeat)
+    print(f"{'feedparser целиком':<32} {old_sec * 1000:>9.2f} мс  пик памяти {old_peak / 1024 / 1024:>7.2f} МБ")
+    print(f"{'потоковый разбор':<32} {new_sec * 1000:>9.2f} мс  пик памяти {new_peak / 1024 / 1024:>7.2f} МБ"
+          f"  (прочитано {read / 1024:.0f} КБ)")
+    if new != old:
+        print("⚠️ записи расходятся с feedparser:")
+        for a, b in zip(old, new):
+            if a != b:
+                print(f"  {a!r} != {b!r}")
+
+
+# Попарная точность и полнота склейки дублей на размеченных заголовках
+def bench_dups(args):
+    with open(args.fixture, encoding='utf-8') as f:
+        stories = json.load(f)['stories']
+    items = [(story['id'], t['source'], t['title']) for story in stories for t in story['titles']]
+    rnd = random.Random(args.seed)
+    rnd.shuffle(items)
+
+    lemmatizer = bot_server.Lemmatizer()
+    lemma_sets = lemmatizer.lemmatize_batch([title for _, _, title in items])
+    index = bot_server.StoryIndex(threshold=args.threshold)
+    assigned = []
+    start = time.perf_counter()
+    for (story_id, source, title), lemmas in zip(items, lemma_sets):
+        news = bot_server.NewsItem(title, '', source, 3, source, datetime.now(), b'')
+        tokens = bot_server.story_tokens(lemmas)
+        signature = index.signature(tokens)
+        anchors = bot_server.StoryAnchors.build(title, tokens)
+        cluster = index.match(signature, anchors=anchors)
+        if cluster is None:
+            cluster = index.add(news, signature, anchors=anchors)
+        assigned.append(id(cluster))
+    report('сигнатура + поиск в индексе', time.perf_counter() - start, len(items))
+
+    tp = fp = fn = 0
+    for i in range(len(items)):
+        for j in range(i + 1, len(items)):
+            same_story = items[i][0] == items[j][0]
+            same_cluster = assigned[i] == assigned[j]
+            tp += same_story and same_cluster
+            fp += same_cluster and not same_story
+            fn += same_story and not same_cluster
+            if args.verbose and same_story != same_cluster:
+                kind = 'лишняя склейка' if same_cluster else 'не склеено'
+                print(f"  {kind}: «{items[i][2]}» / «{items[j][2]}»")
+    precision = tp / (tp + fp) if tp + fp else 1.0
+    recall = tp / (tp + fn) if tp + fn else 1.0
+    print(f"заголовков: {len(items)}, историй: {len(stories)}, порог: {args.threshold}")
+    print(f"точность: {precision:.2f}, полнота: {recall:.2f} (пары: tp={tp}, fp={fp}, fn={fn})")
+
+    # Трудные отрицательные: тот же шаблон заголовка о другом событии, склеивать нельзя
+    negatives = {(story['id'], story['hard_negative_of']) for story in stories if story.get('hard_negative_of')}
+    pairs = merged = 0
+    for i in range(len(items)):
+        for j in range(len(items)):
+            if (items[i][0], items[j][0]) in negatives:
+                pairs += 1
+                merged += assigned[i] == assigned[j]
+    if pairs:
+        print(f"трудные отрицательные: склеено {merged} из {pairs} пар, точность на них: {1 - merged / pairs:.2f}")
+    check_same_batch_dups(items, args.threshold)
+
+
+# Копии одной истории, пришедшие в одном опросе, должны склеиваться так же,
+# как пришедшие в разных: сообщений в очереди столько же, сколько при подаче по одной
+def check_same_batch_dups(items: list, threshold: float):
+    import asyncio
+    bot = bot_server.RussianMarketNewsBot('bench', 'bench-chat')
+    news_items = [bot_server.NewsItem(title, f"https://example.com/{i}", source, 3, source, datetime.now(), b'')
+                  for i, (_, source, title) in enumerate(items)]
+
+    async def queued(batched: bool) -> int:
+        bot.story_index = bot_server.StoryIndex(threshold=threshold)
+        bot.delivery = bot_server.DeliveryQueue('bench', None)
+        if batched:
+            await bot.collapse_duplicates(news_items)
+        else:
+            for news in news_items:
+                await bot.collapse_duplicates([news])
+        return len(bot.delivery)
+
+    async def run():
+        delivery = bot.delivery
+        one_by_one, batched = await queued(False), await queued(True)
+        bot.delivery = delivery
+        await close_bot(bot)
+        bot_server.pools.shutdown()
+        return one_by_one, batched
+
+    one_by_one, batched = asyncio.run(run())
+    print(f"сообщений в очереди: по одной {one_by_one}, одним опросом {batched}")
+    assert one_by_one == batched, 'копии истории из одного опроса не склеены'
+
+
+# Время и память импорта в отдельном процессе: так видно именно стоимость старта
+STARTUP_PROBE = '''
+import json, resource, sys, time
+started = time.perf_counter()
+import bot_server
+imported = time.perf_counter() - started
+import_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+modules = sorted(m for m in sys.modules if m.split('.')[0] in ('natasha', 'navec', 'slovnet', 'razdel', 'pymorphy2'))
+started = time.perf_counter()
+bot_server.nlp.load()
+loaded = time.perf_counter() - started
+print(json.dumps({'import_sec': imported, 'import_rss_kb': import_rss, 'nlp_modules_on_import': modules,
+                  'nlp_load_sec': loaded, 'total_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+'''
+
+
+# Архив: вставка пакетами и запросы к индексу на N заголовках. Вместо лемм
+# в индекс кладутся сами слова — Natasha на миллионе заголовков шла бы часами
+def bench_archive(args):
+    import asyncio
+    sources = ['rbc', 'interfax', 'kommersant', 'vedomosti', 'cbr', 'moex']
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = bot_server.NewsArchive(path=os.path.join(tmp, 'archive.sqlite3'))
+        rnd = random.Random(1)
+        now = time.time()
+        start = time.perf_counter()
+        headlines = synthetic_headlines(min(args.n, 100_000))
+        for first in range(0, args.n, args.batch):
+            rows = []
+            for i in range(first, min(first + args.batch, args.n)):
+                title = headlines[i % len(headlines)]
+                ts = now - (args.n - i) * args.days * 86400 / args.n
+                rows.append((ts, sources[i % len(sources)], rnd.randint(1, 4), 'cat', title, f"https://example.com/{i}",
+                             f"{i:032x}", " ".join(bot_server.WORD_RE.findall(title.lower()))))
+            archive._insert(rows)
+        report('вставка', time.perf_counter() - start, args.n)
+        print(f"записей: {len(archive)}, файл: {os.path.getsize(archive.path) / 1e6:.0f} МБ")
+
+        queries = [
+            ('слово', dict(query='газпром')),
+            ('слово + 7 дней', dict(query='газпром', since=now - 7 * 86400)),
+            ('два слова + источник', dict(query='сбербанк дивиденды', source='rbc')),
+            ('префикс', dict(query='дивиденд')),
+            ('редкое слово', dict(query='нетакогослова')),
+            ('приоритет 1 за сутки', dict(since=now - 86400, max_priority=1)),
+            ('последние', dict()),
+        ]
+
+        async def run_queries():
+            for name, kwargs in queries:
+                found = await archive.search(limit=args.limit, **kwargs)
+                start = time.perf_counter()
+                for _ in range(args.repeat):
+                    await archive.search(limit=args.limit, **kwargs)
+                elapsed = (time.perf_counter() - start) / args.repeat
+                print(f"{name:<32} {elapsed * 1000:>9.2f} мс  найдено {len(found)}")
+            await archive.close()
+        asyncio.run(run_queries())
+
+
+# Отбор записей лент: N записей с долей устаревших, уже виденных и посторонних
+# (не проходят фильтры). Время CPU на запись и память на принятую NewsItem
+OFFTOPIC_TITLES = ['Погода в Москве на выходные', 'Сборная проиграла товарищеский матч', 'В прокат выходит новый фильм',
+                   'Синоптики пообещали снег', 'Открылась выставка современного искусства']
+
+def synthetic_entries(n: int, stale: float, seen: float, offtopic: float, seed: int = 42) -> list:
+    rnd = random.Random(seed)
+    headlines = synthetic_headlines(min(n, 100_000), seed)
+    fresh_time = (datetime.now(timezone.utc) - timedelta(hours=1)).timetuple()[:6]
+    stale_time = (datetime.now(timezone.utc) - timedelta(days=3)).timetuple()[:6]
+    entries = []
+    for i in range(n):
+        roll = rnd.random()
+        title = rnd.choice(OFFTOPIC_TITLES) + f" ({i})" if roll < offtopic else headlines[i % len(headlines)]
+        entries.append({
+            'title': title,
+            'link': f"https://example.com/news/{seed}/{i}",
+            'description': 'Краткое описание новости для ленты',
+            'published_parsed': stale_time if rnd.random() < stale else fresh_time,
+            'seen': rnd.random() < seen,
+        })
+    return entries
+
+
+def bench_entries(args):
+    bot = bot_server.RussianMarketNewsBot('bench', 'bench-chat')
+    # Отбор идёт по хранилищу просмотренных в памяти
+    bot.seen_news.close()
+    entries = synthetic_entries(args.n, args.stale, args.seen, args.offtopic)
+    seen = [bot_server.link_digest(entry['link']) for entry in entries if entry.pop('seen')]
+    config = {'url': 'https://example.com/rss', 'priority': 2, 'category': 'bench'}
+
+    def run():
+        bot.seen_news = bot_server.MemorySeenStore()
+        bot.seen_news.add_many(seen)
+        return bot.select_entries('bench', config, config['url'], entries)
+
+    best = float('inf')
+    for _ in range(args.repeat):
+        before = dict(bot_server.ITEMS.values)
+        start = time.process_time()
+        items = run()
+        best = min(best, time.process_time() - start)
+    report('отбор записей (CPU, лучший)', best, len(entries))
+    stages = {stage: int(count - before.get((source, stage), 0))
+              for (source, stage), count in bot_server.ITEMS.values.items() if source == 'bench'}
+    print("этапы: " + ", ".join(f"{stage} {count}" for stage, count in sorted(stages.items()) if count))
+    del items
+    tracemalloc.start()
+    items = run()
+    current, peak = tracemalloc.get_traced_memory()
+    accepted = len(items)
+    del items
+    # Память принятых записей — то, что освобождается вместе со списком
+    # (NewsItem, хеш, дата, маршруты; строки заголовков и ссылок общие с записями ленты)
+    retained = current - tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"принято {accepted}: {retained / max(accepted, 1):.0f} байт на запись, пик {peak / 1e6:.1f} МБ")
+    import asyncio
+    asyncio.run(close_bot(bot))
+
+
+# Время от запуска процесса бота до первого ответа /health. Порт должен
+# открываться раньше, чем бот откроет хранилища, очередь и архив — иначе
+# PaaS снимает контейнер по таймауту health check
+def probe_health(here: str, timeout: float = 60) -> float:
+    import socket
+    import urllib.request
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, 'rss_sources.json'), 'w', encoding='utf-8') as f:
+            json.dump({'local': {'url': 'http://127.0.0.1:9/rss', 'priority': 3}}, f)
+        env = dict(os.environ, TELEGRAM_BOT_TOKEN='bench', TELEGRAM_CHAT_ID='bench', TELEGRAM_API_URL='http://127.0.0.1:9',
+                   PORT=str(port), NLP_LOAD_DELAY_SEC='3600')
+        started = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, os.path.join(here, 'bot_server.py')], cwd=tmp, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while time.perf_counter() - started < timeout:
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                        if response.status == 200:
+                            return time.perf_counter() - started
+                except OSError:
+                    time.sleep(0.02)
+            return float('inf')
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+def bench_startup(args):
+    here = os.path.dirname(os.path.abspath(__file__))
+    runs = []
+    for _ in range(args.repeat):
+        out = subprocess.run([sys.executable, '-c', STARTUP_PROBE], cwd=here, capture_output=True, text=True, check=True)
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    best = min(runs, key=lambda r: r['import_sec'])
+    import_mb = best['import_rss_kb'] / 1024
+    print(f"импорт bot_server:        {best['import_sec'] * 1000:>8.0f} мс, RSS {import_mb:.0f} МБ")
+    print(f"загрузка моделей Natasha: {best['nlp_load_sec'] * 1000:>8.0f} мс, RSS после {best['total_rss_kb'] / 1024:.0f} МБ")
+    health_sec = min(probe_health(here) for _ in range(args.repeat))
+    print(f"первый ответ /health:     {health_sec * 1000:>8.0f} мс с запуска процесса")
+    failed = False
+    if best['nlp_modules_on_import']:
+        print(f"❌ модели NLP импортируются при старте: {', '.join(best['nlp_modules_on_import'][:5])}")
+        failed = True
+    if args.max_import_sec and best['import_sec'] > args.max_import_sec:
+        print(f"❌ импорт дольше {args.max_import_sec} с")
+        failed = True
+    if args.max_import_mb and import_mb > args.max_import_mb:
+        print(f"❌ память после импорта больше {args.max_import_mb} МБ")
+        failed = True
+    if args.max_health_sec and health_sec > args.max_health_sec:
+        print(f"❌ /health отвечает позже чем через {args.max_health_sec} с")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+# Доставка против заглушки Telegram с лимитом на чат: неотправленное из outbox
+# переживает перезапуск очереди, 429 с retry_after не теряют сообщений, а срочное
+# сообщение обгоняет накопившуюся очередь. Бот шлёт быстрее, чем разрешает
+# заглушка, чтобы 429 были гарантированно
+def bench_delivery(args):
+    import asyncio
+    import aiohttp
+    from aiohttp import web
+    from fake_telegram import FakeTelegram
+
+    chat = 'bench-chat'
+    telegram = FakeTelegram(chat_limit_per_min=args.chat_limit, global_limit_per_sec=0)
+
+    async def run():
+        runner = web.AppRunner(telegram.create_app())
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        api_url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+        path = os.path.join(BENCH_STATE.name, 'delivery-outbox.sqlite3')
+        try:
+            # Очередь «до перезапуска»: сообщения только в outbox, отправить не успели
+            before = bot_server.DeliveryQueue('bench', bot_server.Outbox(path), api_url)
+            for i in range(args.restored):
+                before.put(chat, 4, f"restored-{i}")
+            before.outbox.close()
+
+            queue = bot_server.DeliveryQueue('bench', bot_server.Outbox(path), api_url)
+            assert len(queue) == args.restored, f'из outbox восстановлено {len(queue)} из {args.restored}'
+            for i in range(args.n - args.restored - 1):
+                queue.put(chat, 4, f"regular-{i}")
+            queue.chat_buckets[chat] = bot_server.TokenBucket(args.send_rate, args.send_rate)
+
+            async with aiohttp.ClientSession() as session:
+                task = asyncio.create_task(queue.run(session))
+                started = time.perf_counter()
+                while not telegram.rejected_429 and time.perf_counter() - started < args.timeout:
+                    await asyncio.sleep(0.01)
+                urgent_at = time.perf_counter()
+                queue.put(chat, 1, "urgent")
+                urgent_sec = None
+                while queue.sent < args.n and time.perf_counter() - started < args.timeout:
+                    if urgent_sec is None and any(m['text'] == 'urgent' for m in telegram.messages):
+                        urgent_sec = time.perf_counter() - urgent_at
+                        urgent_pending = len(queue)
+                    await asyncio.sleep(0.01)
+                elapsed = time.perf_counter() - started
+                queue.stop()
+                await task
+            queue.flush()
+            left_in_outbox = len(queue.outbox.pending())
+            queue.outbox.close()
+        finally:
+            await runner.cleanup()
+
+        print(f"доставлено {queue.sent} из {args.n} за {elapsed:.1f} с, ответов 429: {telegram.rejected_429}, ошибок: {queue.failed}")
+        assert queue.sent == args.n, f'доставлено {queue.sent} из {args.n}'
+        assert queue.failed == 0, f'ошибок доставки: {queue.failed}'
+        assert telegram.rejected_429 > 0, 'заглушка ни разу не ответила 429 — сценарий ничего не проверил'
+        texts = ' '.join(m['text'] for m in telegram.messages)
+        missing = [t for t in [f"restored-{i}" for i in range(args.restored)] if t not in texts]
+        assert not missing, f'не доставлены сообщения из outbox: {missing}'
+        assert left_in_outbox == 0, f'в outbox осталось {left_in_outbox}'
+        assert urgent_sec is not None, 'срочное сообщение не доставлено'
+        print(f"срочное доставлено через {urgent_sec:.2f} с, в очереди за ним оставалось {urgent_pending}")
+        assert urgent_pending > 0, 'срочное ушло последним — приоритет не сработал'
+        assert urgent_sec <= args.max_urgent_sec, f'срочное шло дольше {args.max_urgent_sec} с'
+
+    asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Микробенчмарки news-бота')
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    p = sub.add_parser('dedup', help='хранилище просмотренных новостей')
+    p.add_argument('-n', type=int, default=1_000_000, help='число хешей в индексе')
+    p.add_argument('--lookups', type=int, default=100_000)
+    p.add_argument('--no-bloom', action='store_true', help='без Bloom-фильтра перед sqlite')
+    p.add_argument('--expired', type=float, default=0.1, help='доля записей старше TTL')
+    p.set_defaults(func=bench_dedup)
+
+    p = sub.add_parser('lemmas', help='лемматизация и сопоставление с ключевыми словами')
+    p.add_argument('-n', type=int, default=5000, help='число заголовков')
+    p.add_argument('--keywords', type=int, default=50, help='число ключевых слов из whitelist')
+    p.add_argument('--legacy', type=int, default=200, help='сколько заголовков прогнать через старую реализацию')
+    p.add_argument('--batch', type=int, default=256)
+    p.set_defaults(func=bench_lemmas)
+
+    p = sub.add_parser('keywords', help='фильтры и приоритет: линейный поиск против автомата')
+    p.add_argument('-n', type=int, default=5000, help='число заголовков')
+    p.add_argument('--companies', type=int, nargs='+', default=[20, 100, 200, 300, 1000, 5000], help='размеры списка компаний')
+    p.set_defaults(func=bench_keywords)
+
+    p = sub.add_parser('stream', help='потоковый разбор ленты против feedparser целиком')
+    p.add_argument('--fixture', help='записанная лента (по умолчанию — синтетический full.rss)')
+    p.add_argument('--items', type=int, default=60)
+    p.add_argument('--body-kb', type=int, default=8, help='размер полного текста статьи')
+    p.add_argument('--repeat', type=int, default=5)
+    p.set_defaults(func=bench_stream)
+
+    p = sub.add_parser('dups', help='точность и полнота склейки дублей историй')
+    p.add_argument('--fixture', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'near_duplicates.json'))
+    p.add_argument('--threshold', type=float, default=bot_server.DUPLICATE_THRESHOLD)
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('-v', '--verbose', action='store_true', help='показать ошибочные пары')
+    p.set_defaults(func=bench_dups)
+
+    p = sub.add_parser('archive', help='архив новостей: вставка и поиск')
+    p.add_argument('-n', type=int, default=1_000_000, help='число записей в архиве')
+    p.add_argument('--batch', type=int, default=bot_server.ARCHIVE_BATCH_SIZE)
+    p.add_argument('--days', type=float, default=365, help='за сколько дней распределить записи')
+    p.add_argument('--limit', type=int, default=50)
+    p.add_argument('--repeat', type=int, default=20)
+    p.set_defaults(func=bench_archive)
+
+    p = sub.add_parser('entries', help='отбор записей лент: время и память на запись')
+    p.add_argument('-n', type=int, default=100_000, help='число записей')
+    p.add_argument('--stale', type=float, default=0.3, help='доля устаревших')
+    p.add_argument('--seen', type=float, default=0.4, help='доля уже виденных')
+    p.add_argument('--offtopic', type=float, default=0.5, help='доля не проходящих фильтры')
+    p.add_argument('--repeat', type=int, default=5)
+    p.set_defaults(func=bench_entries)
+
+    p = sub.add_parser('delivery', help='доставка: 429 и retry_after, обгон срочным, восстановление из outbox')
+    p.add_argument('-n', type=int, default=26, help='всего сообщений, включая срочное')
+    p.add_argument('--restored', type=int, default=5, help='сколько из них лежит в outbox до запуска очереди')
+    p.add_argument('--chat-limit', type=float, default=120, help='лимит заглушки, сообщений в минуту на чат')
+    p.add_argument('--send-rate', type=float, default=10, help='с какой частотой бот пытается слать в чат, в секунду')
+    p.add_argument('--max-urgent-sec', type=float, default=2.5, help='порог доставки срочного сообщения')
+    p.add_argument('--timeout', type=float, default=60)
+    p.set_defaults(func=bench_delivery)
+
+    p = sub.add_parser('startup', help='время и память импорта bot_server (регрессии холодного старта)')
+    p.add_argument('--repeat', type=int, default=3)
+    p.add_argument('--max-import-sec', type=float, default=0, help='порог времени импорта (0 — не проверять)')
+    p.add_argument('--max-import-mb', type=float, default=0, help='порог RSS после импорта (0 — не проверять)')
+    p.add_argument('--max-health-sec', type=float, default=0, help='порог до первого ответа /health (0 — не проверять)')
+    p.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,32 @@
 import asyncio
 import aiohttp
+import heapq
+import itertools
+import random
+from collections import deque
 import feedparser
 import logging
 import os
-from natasha import Segmenter, NewsEmbedding, NewsMorphTagger, MorphVocab, Doc
 import re
 from datetime import datetime, timedelta, timezone
-from typing import List, Dict, Set
+from typing import List, Dict, Set, Iterable, Optional
 import json
-from dataclasses import dataclass
+from dataclasses import dataclass, field, asdict, replace
 import hashlib
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
+from email.utils import parsedate_to_datetime
+import xml.etree.ElementTree as ET
 from dotenv import load_dotenv
 
 # Загрузка переменных окружения
 load_dotenv()
 
-# Инициализация Natasha
-segmenter = Segmenter()
-emb = NewsEmbedding()
-morph_tagger = NewsMorphTagger(emb)
-morph_vocab = MorphVocab()
-
 # Самарская timezone (GMT+4)
 SAMARA_TZ = timezone(timedelta(hours=4))
 
@@ -34,11 +39,106 @@ DEFAULT_HEADERS = {
     # Включаем RSS/XML mime-типы, чтобы избежать 406 (Not Acceptable)
     "Accept": "application/rss+xml, application/xml;q=0.9, text/xml;q=0.9, text/html;q=0.8, */*;q=0.7",
     "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
-    "Cache-Control": "no-cache",
 }
 MAX_FETCH_RETRIES = 3
 BASE_BACKOFF_SEC = 1.0
 
+# Пулы соединений: общий лимит и лимит на хост (news.google.com отдаёт много зеркал сразу)
+FEED_CONN_LIMIT = int(os.getenv('FEED_CONN_LIMIT', '64'))
+FEED_CONN_PER_HOST = int(os.getenv('FEED_CONN_PER_HOST', '4'))
+# Keep-alive дольше минимального интервала опроса, чтобы соединение доживало до следующего запроса
+HTTP_KEEPALIVE_SEC = float(os.getenv('HTTP_KEEPALIVE_SEC', '75'))
+DNS_CACHE_TTL_SEC = int(os.getenv('DNS_CACHE_TTL_SEC', '600'))
+
+# Окно свежести новостей: старше — не отправляем и не храним в индексе просмотренных
+NEWS_MAX_AGE = timedelta(hours=24)
+# Сколько самых свежих записей ленты рассматриваем за один опрос
+FEED_MAX_ENTRIES = 10
+
+# Потоковый разбор лент: читаем ответ кусками и останавливаемся, как только набрали
+# FEED_MAX_ENTRIES записей или дошли до уже виденной/устаревшей
+STREAMING_PARSE = os.getenv('STREAMING_PARSE', '1') == '1'
+STREAM_CHUNK_SIZE = 16 * 1024
+# По скольким первым байтам ответа считаем отпечаток для кеша лент в потоковом режиме
+STREAM_DIGEST_BYTES = 64 * 1024
+# Недочитанный ответ закрывает соединение. Хвост до стольких байт дочитываем,
+# чтобы соединение вернулось в пул keep-alive (0 — всегда закрывать)
+STREAM_DRAIN_BYTES = int(os.getenv('STREAM_DRAIN_BYTES', str(256 * 1024)))
+
+# Хранилище просмотренных новостей: sqlite (переживает рестарт) или memory
+SEEN_STORE = os.getenv('SEEN_STORE', 'sqlite')
+SEEN_DB_PATH = os.getenv('SEEN_DB_PATH', 'seen_news.sqlite3')
+# Ёмкость Bloom-фильтра перед sqlite (0 — отключить)
+SEEN_BLOOM_CAPACITY = int(os.getenv('SEEN_BLOOM_CAPACITY', '200000'))
+
+# Доставка в Telegram: адрес API (можно указать локальный fake_telegram.py),
+# лимиты Telegram на чат и глобально, склейка низкоприоритетных новостей в дайджест
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+TELEGRAM_CHAT_RATE_PER_MIN = float(os.getenv('TELEGRAM_CHAT_RATE_PER_MIN', '20'))
+TELEGRAM_CHAT_BURST = int(os.getenv('TELEGRAM_CHAT_BURST', '3'))
+TELEGRAM_GLOBAL_RATE_PER_SEC = float(os.getenv('TELEGRAM_GLOBAL_RATE_PER_SEC', '30'))
+DELIVERY_CONCURRENCY = int(os.getenv('DELIVERY_CONCURRENCY', '4'))
+# Новости с приоритетом >= DIGEST_MIN_PRIORITY склеиваются в дайджест (0 — отключено)
+DIGEST_MIN_PRIORITY = int(os.getenv('DIGEST_MIN_PRIORITY', '0'))
+DIGEST_MAX_ITEMS = int(os.getenv('DIGEST_MAX_ITEMS', '10'))
+OUTBOX_DB_PATH = os.getenv('OUTBOX_DB_PATH', 'outbox.sqlite3')
+
+# Архив принятых новостей с полнотекстовым поиском (пусто — не вести архив)
+ARCHIVE_DB_PATH = os.getenv('ARCHIVE_DB_PATH', 'news_archive.sqlite3')
+# Записи копятся и пишутся пакетом раз в ARCHIVE_FLUSH_SEC или по ARCHIVE_BATCH_SIZE штук
+ARCHIVE_FLUSH_SEC = float(os.getenv('ARCHIVE_FLUSH_SEC', '2'))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '500'))
+TELEGRAM_MAX_MESSAGE_LEN = 4096
+
+# Предохранитель для URL лент: после N ошибок подряд URL пропускается на время остывания;
+# хеджирование — через сколько секунд без ответа параллельно запрашивать следующее зеркало
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '3'))
+BREAKER_COOLDOWN_SEC = float(os.getenv('BREAKER_COOLDOWN_SEC', '300'))
+HEDGE_DELAY_SEC = float(os.getenv('HEDGE_DELAY_SEC', '5'))
+MIRROR_HEALTH_PATH = os.getenv('MIRROR_HEALTH_PATH', 'mirror_health.json')
+
+# Склейка одной и той же истории из разных источников (MinHash + LSH по леммам заголовков)
+DUPLICATE_DETECTION = os.getenv('DUPLICATE_DETECTION', '1') == '1'
+DUPLICATE_WINDOW_HOURS = float(os.getenv('DUPLICATE_WINDOW_HOURS', '6'))
+DUPLICATE_THRESHOLD = float(os.getenv('DUPLICATE_THRESHOLD', '0.4'))
+# Дописывать к ещё не отправленному сообщению другие источники той же истории
+DUPLICATE_ATTACH_SOURCES = os.getenv('DUPLICATE_ATTACH_SOURCES', '1') == '1'
+
+# Планировщик опроса: у каждого источника свой интервал в этих пределах
+MIN_POLL_INTERVAL_SEC = float(os.getenv('MIN_POLL_INTERVAL_SEC', '30'))
+MAX_POLL_INTERVAL_SEC = float(os.getenv('MAX_POLL_INTERVAL_SEC', '900'))
+SOURCE_POLL_TIMEOUT_SEC = float(os.getenv('SOURCE_POLL_TIMEOUT_SEC', '300'))
+
+# Профилирование event loop: замер задержек цикла и лог медленных колбэков
+LOOP_PROFILING = os.getenv('LOOP_PROFILING', '0') == '1'
+LOOP_SLOW_CALLBACK_SEC = float(os.getenv('LOOP_SLOW_CALLBACK_SEC', '0.1'))
+
+# Токен для служебных POST-эндпоинтов (заголовок X-Admin-Token); без него они отключены
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+
+# Через сколько секунд после старта грузить модели Natasha, если первый цикл опроса затянулся
+NLP_LOAD_DELAY_SEC = float(os.getenv('NLP_LOAD_DELAY_SEC', '60'))
+
+# Подписчики: разные чаты со своими фильтрами (по умолчанию — один TELEGRAM_CHAT_ID)
+SUBSCRIBERS_FILE = os.getenv('SUBSCRIBERS_FILE', 'subscribers.json')
+
+# Пулы для разбора лент и лемматизации: thread — потоки, process — отдельные процессы
+# (разбор масштабируется по ядрам, но каждый процесс NLP держит свою копию моделей)
+WORKER_POOL = os.getenv('WORKER_POOL', 'thread')
+PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', str(min(4, os.cpu_count() or 1))))
+# Задачи копятся до WORKER_BATCH_SIZE штук или WORKER_BATCH_WAIT_MS и уходят в пул одним вызовом
+WORKER_BATCH_SIZE = int(os.getenv('WORKER_BATCH_SIZE', '8'))
+WORKER_BATCH_WAIT_MS = float(os.getenv('WORKER_BATCH_WAIT_MS', '5'))
+
+# Как часто проверять изменения rss_sources.json / news_filters.json / subscribers.json (0 — не следить)
+CONFIG_WATCH_INTERVAL_SEC = float(os.getenv('CONFIG_WATCH_INTERVAL_SEC', '5'))
+
+# Размер LRU-кеша лемм заголовков
+LEMMA_CACHE_SIZE = int(os.getenv('LEMMA_CACHE_SIZE', '20000'))
+
+# Кеш валидаторов HTTP (ETag / Last-Modified) для условных запросов к лентам
+FEED_CACHE_PATH = os.getenv('FEED_CACHE_PATH', 'feed_cache.json')
+
 # Встроенные зеркала для источников (используются ТОЛЬКО если в конфиге нет alt_urls)
 MIRROR_FALLBACKS: dict[str, list[str]] = {
     # ключи в нижнем регистре; поддерживаем как русские, так и латинские варианты названий
@@ -90,34 +190,1404 @@ SYNONYMS = {
     'кризис': ['кризис', 'спад', 'рецессия'],
 }
 
+# ---------------------------------------------------------------------------
+# Метрики в формате Prometheus (/metrics)
+# ---------------------------------------------------------------------------
+# Небольшая собственная реализация счётчиков, gauge и гистограмм с метками,
+# чтобы не тянуть prometheus_client ради одного эндпоинта.
+
+def _escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# Значение без потери точности (как в prometheus_client): '%g' оставляет 6 цифр,
+# и большие счётчики вроде байтов превращаются в ступеньки
+def _format_value(value) -> str:
+    value = float(value)
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(value)
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+
+    def _label_str(self, values: tuple, extra: str = '') -> str:
+        parts = [f'{k}="{_escape_label(v)}"' for k, v in zip(self.labels, values)]
+        if extra:
+            parts.append(extra)
+        return '{' + ','.join(parts) + '}' if parts else ''
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        super().__init__(name, help_text, labels)
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, *label_values, value: float = 1.0):
+        self.values[label_values] = self.values.get(label_values, 0.0) + value
+
+    def get(self, *label_values) -> float:
+        return self.values.get(label_values, 0.0)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{self._label_str(k)} {_format_value(v)}" for k, v in self.values.items()]
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), callback=None):
+        super().__init__(name, help_text, labels)
+        self.values: Dict[tuple, float] = {}
+        # callback() -> {tuple меток: значение}; вычисляется при каждом запросе /metrics
+        self.callback = callback
+
+    def set(self, value: float, *label_values):
+        self.values[label_values] = value
+
+    def samples(self) -> List[str]:
+        values = self.values
+        if self.callback is not None:
+            try:
+                values = self.callback()
+            except Exception as e:
+                logging.error(f"Ошибка вычисления метрики {self.name}: {e}")
+                values = {}
+        return [f"{self.name}{self._label_str(k)} {_format_value(v)}" for k, v in values.items()]
+
+class Histogram(_Metric):
+    kind = 'histogram'
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+        # метки -> [счётчики по корзинам..., сумма, количество]
+        self.values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        data = self.values.get(label_values)
+        if data is None:
+            data = self.values[label_values] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                data[i] += 1
+        data[-2] += value
+        data[-1] += 1
+
+    def time(self, *label_values) -> "_Timer":
+        return _Timer(self, label_values)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for k, data in self.values.items():
+            for bound, count in zip(self.buckets, data):
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{self._label_str(k, le)} {count}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{self._label_str(k, le)} {data[-1]}")
+            lines.append(f"{self.name}_sum{self._label_str(k)} {_format_value(data[-2])}")
+            lines.append(f"{self.name}_count{self._label_str(k)} {data[-1]}")
+        return lines
+
+class _Timer:
+    def __init__(self, histogram: Histogram, label_values: tuple):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.started
+        self.histogram.observe(self.elapsed, *self.label_values)
+        return False
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: tuple = ()) -> Counter:
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: tuple = (), callback=None) -> Gauge:
+        return self.register(Gauge(name, help_text, labels, callback))
+
+    def histogram(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = Histogram.DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+METRICS = MetricsRegistry()
+FETCH_SECONDS = METRICS.histogram('newsbot_fetch_seconds', 'Время HTTP-запроса ленты', ('source',))
+FETCH_RESPONSES = METRICS.counter('newsbot_fetch_responses_total', 'Ответы при загрузке лент по HTTP-статусу', ('source', 'status'))
+FETCH_BYTES = METRICS.counter('newsbot_fetch_bytes_total', 'Загружено байт лент', ('source',))
+FEED_CACHE_RESULTS = METRICS.counter('newsbot_feed_cache_total', 'Результат условного запроса: not_modified, unchanged, miss', ('source', 'result'))
+STREAM_RESULTS = METRICS.counter('newsbot_stream_parse_total', 'Потоковый разбор ленты: unchanged, complete, stopped, fallback', ('source', 'result'))
+PARSE_SECONDS = METRICS.histogram('newsbot_parse_seconds', 'Время разбора ленты', ('source',))
+FILTER_SECONDS = METRICS.histogram('newsbot_filter_seconds', 'Время фильтрации записей одной ленты', ('source',))
+LEMMATIZE_SECONDS = METRICS.histogram('newsbot_lemmatize_seconds', 'Время лемматизации пакета заголовков')
+DUPLICATES = METRICS.counter('newsbot_duplicates_total', 'Записи, склеенные с уже известной историей', ('source',))
+ITEMS = METRICS.counter('newsbot_items_total', 'Записи лент по этапу отбора: keywords, incomplete, filtered, seen, stale, accepted', ('source', 'stage'))
+SOURCE_KEYWORDS = METRICS.counter('newsbot_source_keywords_total', 'Проверка ключевых слов источника: pass, reject', ('source', 'result'))
+DEDUP_LOOKUPS = METRICS.counter('newsbot_dedup_lookups_total', 'Проверки по хранилищу просмотренных: hit, miss', ('result',))
+POLL_SECONDS = METRICS.histogram('newsbot_poll_seconds', 'Полное время опроса источника', ('source',), (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+CYCLE_SECONDS = METRICS.histogram('newsbot_cycle_seconds', 'За сколько каждый включённый источник опрошен хотя бы раз', (), (1, 5, 10, 30, 60, 120, 300, 600, 900, 1800))
+ARCHIVE_WRITE_SECONDS = METRICS.histogram('newsbot_archive_write_seconds', 'Время записи пакета в архив')
+ARCHIVE_ROWS = METRICS.counter('newsbot_archive_rows_total', 'Записи, добавленные в архив')
+SEARCH_SECONDS = METRICS.histogram('newsbot_search_seconds', 'Время запроса /search')
+HTTP_CONNECTIONS = METRICS.counter('newsbot_http_connections_total', 'Запросы по способу получения соединения: new, reused', ('pool', 'kind'))
+DNS_LOOKUPS = METRICS.counter('newsbot_dns_lookups_total', 'Разрешение имён: hit (из кеша), miss', ('pool', 'result'))
+TELEGRAM_SEND_SECONDS = METRICS.histogram('newsbot_telegram_send_seconds', 'Время запроса sendMessage')
+TELEGRAM_RESPONSES = METRICS.counter('newsbot_telegram_responses_total', 'Ответы Telegram по HTTP-статусу', ('status',))
+DELIVERY_QUEUE_DEPTH = METRICS.gauge('newsbot_delivery_queue_depth', 'Сообщений в очереди доставки')
+MIRRORS_OPEN = METRICS.gauge('newsbot_mirrors_open', 'URL лент с разомкнутым предохранителем')
+LOOP_LAG_SECONDS = METRICS.histogram('newsbot_event_loop_lag_seconds', 'Задержка event loop (при LOOP_PROFILING)', (), (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 5))
+
+# Периодически замеряет, насколько позже запланированного просыпается корутина.
+# Медленные колбэки (дольше LOOP_SLOW_CALLBACK_SEC) asyncio пишет в лог сам в режиме debug.
+class LoopProfiler:
+    INTERVAL_SEC = 0.1
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def start(self):
+        if self.enabled:
+            return
+        loop = asyncio.get_running_loop()
+        loop.slow_callback_duration = LOOP_SLOW_CALLBACK_SEC
+        loop.set_debug(True)
+        logging.getLogger('asyncio').setLevel(logging.WARNING)
+        self.task = asyncio.create_task(self._sample())
+        logging.info(f"🔬 Профилирование event loop включено (порог {LOOP_SLOW_CALLBACK_SEC * 1000:.0f} мс)")
+
+    def stop(self):
+        if not self.enabled:
+            return
+        self.task.cancel()
+        self.task = None
+        asyncio.get_running_loop().set_debug(False)
+        logging.info("🔬 Профилирование event loop выключено")
+
+    async def _sample(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.INTERVAL_SEC
+            await asyncio.sleep(self.INTERVAL_SEC)
+            LOOP_LAG_SECONDS.observe(max(loop.time() - expected, 0.0))
+
+# ---------------------------------------------------------------------------
+# Пулы для CPU-работы
+# ---------------------------------------------------------------------------
+# feedparser и морфотеггер Natasha держат GIL десятки миллисекунд, и пока
+# они работают в корутине, стоят все загрузки, /health и отправка в Telegram.
+# Такая работа уходит в пул потоков или процессов. Чтобы не платить за
+# каждый вызов (для процессов — сериализация и IPC), задачи одного вида
+# копятся в пакет и передаются в пул одним вызовом. Функции пакетов —
+# модульные, чтобы их можно было передать в процесс по имени.
+
+class BatchExecutor:
+    def __init__(self, name: str, func, executor_factory, max_batch: int = WORKER_BATCH_SIZE,
+                 max_wait: float = WORKER_BATCH_WAIT_MS / 1000):
+        self.name = name
+        # func(items) -> results той же длины
+        self.func = func
+        self.executor_factory = executor_factory
+        self.max_batch = max(max_batch, 1)
+        self.max_wait = max_wait
+        self._pending: List[tuple] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        return await future
+
+    async def submit_many(self, items: list) -> list:
+        return await asyncio.gather(*(self.submit(item) for item in items))
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        self.batches += 1
+        self.items += len(batch)
+        loop = asyncio.get_running_loop()
+        try:
+            done = loop.run_in_executor(self.executor_factory(), self.func, [item for item, _ in batch])
+        except Exception as e:
+            # Пул не поднялся (например, процессы не запускаются) — отдаём ошибку ожидающим
+            logging.error(f"Пул {self.name}: {e}")
+            done = loop.create_future()
+            done.set_exception(e)
+        done.add_done_callback(lambda f: self._resolve(batch, f))
+
+    @staticmethod
+    def _resolve(batch: List[tuple], done: asyncio.Future):
+        error = done.exception() if not done.cancelled() else asyncio.CancelledError()
+        results = done.result() if error is None else [None] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+def _init_nlp_worker():
+    nlp.load()
+
+# Проба для пула процессов: выполняется после инициализатора, то есть когда модели загружены
+def _nlp_worker_ready() -> bool:
+    return nlp.ready
+
+# Пулы создаются при первом обращении: холодный старт их не ждёт
+class WorkerPools:
+    def __init__(self, kind: str = WORKER_POOL, parse_workers: int = PARSE_WORKERS):
+        self.kind = kind if kind in ('thread', 'process') else 'thread'
+        self.parse_workers = max(parse_workers, 1)
+        self._parse = None
+        self._nlp = None
+
+    def _process_pool(self, workers: int, initializer=None):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # spawn: дочерний процесс не наследует event loop и потоки родителя
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=initializer)
+
+    def parse(self):
+        if self._parse is None:
+            if self.kind == 'process':
+                self._parse = self._process_pool(self.parse_workers)
+            else:
+                self._parse = ThreadPoolExecutor(max_workers=self.parse_workers, thread_name_prefix='parse')
+            logging.info(f"⚙️ Пул разбора лент: {self.kind} × {self.parse_workers}")
+        return self._parse
+
+    # Natasha не гарантирует потокобезопасность — один рабочий поток или процесс
+    def nlp(self):
+        if self._nlp is None:
+            if self.kind == 'process':
+                self._nlp = self._process_pool(1, _init_nlp_worker)
+            else:
+                self._nlp = ThreadPoolExecutor(max_workers=1, thread_name_prefix='lemmatizer')
+        return self._nlp
+
+    def shutdown(self):
+        for pool in (self._parse, self._nlp):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        self._parse = self._nlp = None
+
+pools = WorkerPools()
+
+# ---------------------------------------------------------------------------
+# HTTP-клиенты
+# ---------------------------------------------------------------------------
+# Одна долгоживущая сессия на процесс для лент и отдельная для Telegram:
+# keep-alive соединения, кеш DNS и TLS-сессии переживают циклы опроса, а
+# медленные ленты не занимают соединения доставки. Сжатие gzip/deflate (и br,
+# если установлен Brotli) aiohttp согласует сам. Долю переиспользованных
+# соединений и попаданий в кеш DNS считают trace-хуки.
+
+FEED_REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=30, sock_connect=10)
+FEED_SESSION_TIMEOUT = aiohttp.ClientTimeout(total=40)
+TELEGRAM_TIMEOUT = aiohttp.ClientTimeout(total=30, sock_connect=10)
+
+def _connection_trace(pool: str) -> aiohttp.TraceConfig:
+    trace = aiohttp.TraceConfig()
+
+    async def on_create(session, ctx, params):
+        HTTP_CONNECTIONS.inc(pool, 'new')
+
+    async def on_reuse(session, ctx, params):
+        HTTP_CONNECTIONS.inc(pool, 'reused')
+
+    async def on_dns_hit(session, ctx, params):
+        DNS_LOOKUPS.inc(pool, 'hit')
+
+    async def on_dns_miss(session, ctx, params):
+        DNS_LOOKUPS.inc(pool, 'miss')
+
+    trace.on_connection_create_end.append(on_create)
+    trace.on_connection_reuseconn.append(on_reuse)
+    trace.on_dns_cache_hit.append(on_dns_hit)
+    trace.on_dns_cache_miss.append(on_dns_miss)
+    return trace
+
+class HttpClients:
+    def __init__(self):
+        self._feeds: Optional[aiohttp.ClientSession] = None
+        self._telegram: Optional[aiohttp.ClientSession] = None
+
+    @staticmethod
+    def _session(pool: str, limit: int, limit_per_host: int, **kwargs) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=limit,
+            limit_per_host=limit_per_host,
+            ttl_dns_cache=DNS_CACHE_TTL_SEC,
+            keepalive_timeout=HTTP_KEEPALIVE_SEC,
+            enable_cleanup_closed=True,
+        )
+        return aiohttp.ClientSession(connector=connector, trace_configs=[_connection_trace(pool)], **kwargs)
+
+    def feeds(self) -> aiohttp.ClientSession:
+        if self._feeds is None or self._feeds.closed:
+            self._feeds = self._session('feeds', FEED_CONN_LIMIT, FEED_CONN_PER_HOST,
+                                        headers=DEFAULT_HEADERS, timeout=FEED_SESSION_TIMEOUT)
+        return self._feeds
+
+    # Все запросы идут на один хост api.telegram.org — лимит по числу параллельных отправок
+    def telegram(self) -> aiohttp.ClientSession:
+        if self._telegram is None or self._telegram.closed:
+            self._telegram = self._session('telegram', DELIVERY_CONCURRENCY, DELIVERY_CONCURRENCY, timeout=TELEGRAM_TIMEOUT)
+        return self._telegram
+
+    @staticmethod
+    def reuse_rate(pool: str) -> Optional[float]:
+        new = HTTP_CONNECTIONS.get(pool, 'new')
+        reused = HTTP_CONNECTIONS.get(pool, 'reused')
+        return reused / (new + reused) if new + reused else None
+
+    def summary_lines(self) -> List[str]:
+        lines = []
+        for pool in ('feeds', 'telegram'):
+            rate = self.reuse_rate(pool)
+            if rate is None:
+                continue
+            hits, misses = DNS_LOOKUPS.get(pool, 'hit'), DNS_LOOKUPS.get(pool, 'miss')
+            lines.append(
+                f"{pool}: переиспользовано {rate:.0%} соединений "
+                f"(новых {HTTP_CONNECTIONS.get(pool, 'new'):.0f}, повторно {HTTP_CONNECTIONS.get(pool, 'reused'):.0f}), "
+                f"DNS из кеша {hits:.0f}/{hits + misses:.0f}"
+            )
+        return lines
+
+    async def close(self):
+        for session in (self._feeds, self._telegram):
+            if session is not None and not session.closed:
+                await session.close()
+        self._feeds = self._telegram = None
+
+http = HttpClients()
+
+# ---------------------------------------------------------------------------
+# Лемматизация с кешированием
+# ---------------------------------------------------------------------------
+# Леммы ключевых слов считаются один раз при загрузке конфигов, леммы
+# заголовков — пакетами (один проход сегментатора и морфотеггера на весь
+# пакет) и кладутся в LRU-кеш. Тяжёлая часть выполняется в отдельном потоке,
+# чтобы не блокировать event loop.
+
+# Модели Natasha грузятся лениво: импорт natasha и построение эмбеддингов
+# занимают секунды и сотни МБ, поэтому бот сначала поднимает HTTP-сервер и
+# делает первый опрос, а модели догружает в фоне. До готовности моделей
+# лемматизация недоступна и используется обычный поиск подстрок.
+class NlpModels:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self.Doc = None
+        self.segmenter = None
+        self.morph_tagger = None
+        self.morph_vocab = None
+
+    # Лемматизация доступна: модели загружены здесь или в процессе пула NLP
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def load(self):
+        with self._lock:
+            if self.Doc is not None:
+                return
+            started = time.perf_counter()
+            from natasha import Segmenter, NewsEmbedding, NewsMorphTagger, MorphVocab, Doc
+            self.Doc = Doc
+            self.segmenter = Segmenter()
+            self.morph_tagger = NewsMorphTagger(NewsEmbedding())
+            self.morph_vocab = MorphVocab()
+            self._ready.set()
+            logging.info(f"🧠 Модели Natasha загружены за {time.perf_counter() - started:.1f} с")
+
+    # С пулом процессов модели нужны только рабочему процессу: он грузит их в
+    # инициализаторе, а здесь лишь дожидаемся пробы — без второй копии в памяти
+    async def load_async(self):
+        if self.ready:
+            return
+        loop = asyncio.get_running_loop()
+        if pools.kind == 'process':
+            started = time.perf_counter()
+            if await loop.run_in_executor(pools.nlp(), _nlp_worker_ready):
+                self._ready.set()
+                logging.info(f"🧠 Модели Natasha загружены в процессе NLP за {time.perf_counter() - started:.1f} с")
+            return
+        await loop.run_in_executor(None, self.load)
+
+    # Синхронные вызовы (бенчмарки, обёртки) дожидаются загрузки сами
+    def ensure(self) -> "NlpModels":
+        if self.Doc is None:
+            self.load()
+        return self
+
+nlp = NlpModels()
+
+WORD_RE = re.compile(r'\w+')
+SPACES_RE = re.compile(r'\s+')
+
+def normalize_key(text: str) -> str:
+    return SPACES_RE.sub(' ', text.lower()).strip()
+
+class Lemmatizer:
+    def __init__(self, cache_size: int = LEMMA_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, frozenset]" = OrderedDict()
+        self._keyword_cache: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self.batcher = BatchExecutor('lemmas', lemmatize_texts, pools.nlp, max_batch=256)
+        self.hits = 0
+        self.misses = 0
+
+    def _tag(self, texts: List[str]) -> List[List]:
+        # Каждый заголовок сегментируем отдельно, чтобы теггер не видел соседние
+        # заголовки как контекст, а сами предложения размечаем одним батчем
+        models = nlp.ensure()
+        docs = []
+        for text in texts:
+            doc = models.Doc(text)
+            doc.segment(models.segmenter)
+            docs.append(doc)
+        sents = [sent for doc in docs for sent in doc.sents]
+        markups = models.morph_tagger.map([[t.text for t in sent.tokens] for sent in sents])
+        for sent, markup in zip(sents, markups):
+            for token, tagged in zip(sent.tokens, markup.tokens):
+                token.pos = tagged.pos
+                token.feats = tagged.feats
+        return [doc.tokens for doc in docs]
+
+    def _lemmas(self, tokens) -> frozenset:
+        lemmas = set()
+        for token in tokens:
+            if WORD_RE.match(token.text):
+                token.lemmatize(nlp.morph_vocab)
+                lemmas.add(token.lemma)
+        return frozenset(lemmas)
+
+    def lemmatize_batch(self, texts: List[str]) -> List[frozenset]:
+        with LEMMATIZE_SECONDS.time():
+            return self._lemmatize_batch(texts)
+
+    def _lemmatize_batch(self, texts: List[str]) -> List[frozenset]:
+        result, todo = self._lookup(texts)
+        pending = [k for k in todo if k]
+        self._store(pending, self.lemmatize_uncached(pending), result, todo)
+        return result
+
+    # Без кеша: то, что уходит в пул
+    def lemmatize_uncached(self, texts: List[str]) -> List[frozenset]:
+        if not texts:
+            return []
+        return [self._lemmas(tokens) for tokens in self._tag(texts)]
+
+    def _lookup(self, texts: List[str]) -> tuple:
+        keys = [normalize_key(t) for t in texts]
+        result: List[Optional[frozenset]] = [None] * len(keys)
+        todo: Dict[str, List[int]] = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                cached = self._cache.get(key)
+                if cached is not None:
+                    self._cache.move_to_end(key)
+                    result[i] = cached
+                    self.hits += 1
+                else:
+                    todo.setdefault(key, []).append(i)
+                    self.misses += 1
+        return result, todo
+
+    def _store(self, pending: List[str], lemma_sets: List[frozenset], result: list, todo: Dict[str, List[int]]):
+        with self._lock:
+            for key, lemmas in zip(pending, lemma_sets):
+                self._cache[key] = lemmas
+                for i in todo[key]:
+                    result[i] = lemmas
+            for i in todo.get('', []):
+                result[i] = frozenset()
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def lemmatize(self, text: str) -> frozenset:
+        return self.lemmatize_batch([text])[0]
+
+    @property
+    def ready(self) -> bool:
+        return nlp.ready
+
+    # Кеш проверяется на месте, в пул уходят только промахи, пакетом вместе с промахами других лент
+    async def alemmatize_batch(self, texts: List[str]) -> List[frozenset]:
+        with LEMMATIZE_SECONDS.time():
+            result, todo = self._lookup(texts)
+            pending = [k for k in todo if k]
+            self._store(pending, await self.batcher.submit_many(pending), result, todo)
+        return result
+
+    def keyword_forms(self, keyword: str) -> tuple:
+        # Для каждого слова ключа — его лемма плюс синонимы; ключ из нескольких
+        # слов совпадает, только если в заголовке есть все они
+        key = keyword.lower()
+        forms = self._keyword_cache.get(key)
+        if forms is None:
+            lemmas = []
+            for token in self._tag([key])[0]:
+                if WORD_RE.match(token.text):
+                    token.lemmatize(nlp.morph_vocab)
+                    lemmas.append(token.lemma)
+            forms = tuple(frozenset({lemma} | set(SYNONYMS.get(lemma, []))) for lemma in lemmas or [key])
+            self._keyword_cache[key] = forms
+        return forms
+
+    def compile_keywords(self, keywords: List[str]) -> List[tuple]:
+        return [self.keyword_forms(k) for k in keywords]
+
+    @staticmethod
+    def match(lemmas: frozenset, compiled: List[tuple]) -> bool:
+        for forms in compiled:
+            for word in forms:
+                if lemmas.isdisjoint(word):
+                    break
+            else:
+                return True
+        return False
+
+def lemmatize_texts(texts: List[str]) -> List[frozenset]:
+    return lemmatizer.lemmatize_uncached(texts)
+
+# Леммы ключевых слов источников; выполняется в пуле NLP вместе с остальной работой Natasha
+def compile_keyword_lists(keyword_lists: Dict[str, List[str]]) -> Dict[str, List[tuple]]:
+    return {name: lemmatizer.compile_keywords(keywords) for name, keywords in keyword_lists.items()}
+
+lemmatizer = Lemmatizer()
+
 def normalize_text_natasha(text: str) -> set[str]:
-    doc = Doc(text.lower())
-    doc.segment(segmenter)
-    doc.tag_morph(morph_tagger)
-    lemmas = set()
-    for token in doc.tokens:
-        token.lemmatize(morph_vocab)
-        if re.match(r'\w+', token.text):
-            lemmas.add(token.lemma)
-    return lemmas
+    return set(lemmatizer.lemmatize(text))
 
 def match_with_synonyms(title: str, keywords: list[str]) -> bool:
-    lemmas = normalize_text_natasha(title)
-    for keyword in keywords:
-        doc = Doc(keyword.lower())
-        doc.segment(segmenter)
-        doc.tag_morph(morph_tagger)
-        if doc.tokens:
-            doc.tokens[0].lemmatize(morph_vocab)
-            lemma = doc.tokens[0].lemma
+    return Lemmatizer.match(lemmatizer.lemmatize(title), lemmatizer.compile_keywords(keywords))
+
+# ---------------------------------------------------------------------------
+# Многошаблонный поиск ключевых слов (Aho-Corasick)
+# ---------------------------------------------------------------------------
+# Все словари (whitelist, blacklist, критичные слова, компании) собираются в
+# один автомат при загрузке конфигов. Один проход по тексту возвращает
+# битовую маску сработавших категорий — стоимость не зависит от числа слов.
+# Семантика совпадает с `word in text.lower()` (поиск подстроки).
+# Автомат написан на Python и обходит текст посимвольно, поэтому на небольших
+# словарях (как в поставляемом конфиге) быстрее линейный поиск подстрок:
+# `in` работает на C. До LINEAR_MAX_WORDS слов используется он, порог —
+# точка пересечения из bench.py keywords.
+
+class KeywordMatcher:
+    LINEAR_MAX_WORDS = 300
+
+    def __init__(self, categories: Dict[str, Iterable[str]], linear: Optional[bool] = None):
+        self.bits: Dict[str, int] = {}
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[int] = [0]
+        # (бит категории, слова) для линейного поиска
+        self.words: List[tuple] = []
+        for i, (category, words) in enumerate(categories.items()):
+            bit = 1 << i
+            self.bits[category] = bit
+            self.words.append((bit, tuple(dict.fromkeys(word.lower() for word in words))))
+        total = sum(len(words) for _, words in self.words)
+        self.linear = total <= self.LINEAR_MAX_WORDS if linear is None else linear
+        if not self.linear:
+            for bit, words in self.words:
+                for word in words:
+                    self._insert(word, bit)
+            self._build_fail_links()
+
+    def _insert(self, word: str, bit: int):
+        node = 0
+        for ch in word:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(0)
+            node = nxt
+        self.out[node] |= bit
+
+    def _build_fail_links(self):
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for ch, child in self.goto[node].items():
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(ch, 0)
+                self.fail[child] = target if target != child else 0
+                self.out[child] |= self.out[self.fail[child]]
+                queue.append(child)
+
+    # wanted — биты категорий, которые нужны вызывающему; линейный поиск проверяет
+    # только их, автомат всё равно находит все (лишние биты вызывающий отбрасывает)
+    def scan(self, text: str, wanted: int = -1) -> int:
+        if self.linear:
+            return self._scan_linear(text, wanted)
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        mask = out[0]
+        for ch in text.lower():
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            mask |= out[node]
+        return mask
+
+    # По категории: первое найденное слово ставит бит, остальные слова категории не проверяются
+    def _scan_linear(self, text: str, wanted: int = -1) -> int:
+        text = text.lower()
+        mask = 0
+        for bit, words in self.words:
+            if not bit & wanted:
+                continue
+            for word in words:
+                if word in text:
+                    mask |= bit
+                    break
+        return mask
+
+    def bit(self, category: str) -> int:
+        return self.bits.get(category, 0)
+
+    def matches(self, text: str) -> Set[str]:
+        mask = self.scan(text)
+        return {category for category, bit in self.bits.items() if mask & bit}
+
+# Поиск подстрокой по тому же правилу, что и по леммам: ключ из нескольких
+# слов совпадает, когда в тексте есть каждое его слово
+class PhraseMatcher:
+    def __init__(self, phrases: Iterable[str]):
+        words = [phrase.lower().split() for phrase in phrases]
+        self.matcher = KeywordMatcher({word: [word] for word in sorted({w for ws in words for w in ws})})
+        self.masks = [sum(self.matcher.bit(w) for w in set(ws)) for ws in words if ws]
+
+    def match(self, text: str) -> bool:
+        mask = self.matcher.scan(text)
+        return any(mask & required == required for required in self.masks)
+
+# ---------------------------------------------------------------------------
+# Маршрутизация по подписчикам
+# ---------------------------------------------------------------------------
+# Ленты опрашиваются один раз, а каждая запись раздаётся всем чатам, чьи
+# правила она проходит. Словари всех подписчиков собраны в один автомат,
+# где у каждого подписчика свой бит в маске whitelist, blacklist и компаний.
+# Результат сканирования — это и есть инвертированный индекс «слово →
+# подписчики»: решение для всех чатов сразу получается битовыми операциями,
+# без цикла по подписчикам; перебираются только те, кому запись уходит.
+
+@dataclass
+class Subscriber:
+    name: str
+    chat_id: str
+    whitelist: List[str] = field(default_factory=list)
+    blacklist: List[str] = field(default_factory=list)
+    tracked_companies: List[str] = field(default_factory=list)
+    # максимальный (наименее важный) приоритет, который чат получает: 1..4
+    min_priority: int = 4
+    # ограничение по источникам; None — все
+    sources: Optional[List[str]] = None
+
+def _iter_bits(mask: int):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+class SubscriptionRouter:
+    def __init__(self, subscribers: List[Subscriber], critical_keywords: List[str]):
+        self.subscribers = subscribers
+        n = len(subscribers)
+        self.n = n
+        self.all = (1 << n) - 1
+        categories: Dict[str, Iterable[str]] = {}
+        for i, sub in enumerate(subscribers):
+            categories[f"whitelist:{i}"] = sub.whitelist
+        for i, sub in enumerate(subscribers):
+            categories[f"blacklist:{i}"] = sub.blacklist
+        categories['critical'] = critical_keywords
+        for i, sub in enumerate(subscribers):
+            categories[f"company:{i}"] = sub.tracked_companies
+        self.matcher = KeywordMatcher(categories)
+        self.critical_bit = self.matcher.bit('critical')
+        self.no_whitelist = sum(1 << i for i, sub in enumerate(subscribers) if not sub.whitelist)
+        self.min_priority_masks = {
+            p: sum(1 << i for i, sub in enumerate(subscribers) if sub.min_priority >= p) for p in range(1, 6)
+        }
+        self._source_masks: Dict[str, int] = {}
+        # Одинаковые маршруты разделяются записями: словари только для чтения
+        self._routes: Dict[tuple, Dict[str, int]] = {}
+
+    def source_mask(self, source_name: str) -> int:
+        mask = self._source_masks.get(source_name)
+        if mask is None:
+            mask = sum(1 << i for i, sub in enumerate(self.subscribers) if sub.sources is None or source_name in sub.sources)
+            self._source_masks[source_name] = mask
+        return mask
+
+    def _priority_mask(self, priority: int) -> int:
+        if priority < 1:
+            return self.all
+        return self.min_priority_masks.get(priority, 0)
+
+    # Маска подписчиков, чьи whitelist/blacklist пропускают заголовок
+    def accepts(self, title: str, source_name: str) -> int:
+        candidates = self.source_mask(source_name)
+        if not candidates:
+            return 0
+        mask = self.matcher.scan(title, candidates | (candidates << self.n))
+        whitelisted = mask & self.all
+        blacklisted = (mask >> self.n) & self.all
+        return (whitelisted | self.no_whitelist) & ~blacklisted & candidates
+
+    # chat_id -> приоритет для каждого чата, которому уходит запись
+    def route(self, title: str, description: str, source_name: str, source_priority: int, accepted: Optional[int] = None) -> Dict[str, int]:
+        if accepted is None:
+            accepted = self.accepts(title, source_name)
+        if not accepted:
+            return {}
+        mask = self.matcher.scan(f"{title} {description}", self.critical_bit | (accepted << (2 * self.n + 1)))
+        if mask & self.critical_bit:
+            groups = (accepted & self._priority_mask(1), 1)
         else:
-            lemma = keyword.lower()
-        all_forms = {lemma} | set(SYNONYMS.get(lemma, []))
-        if lemmas & all_forms:
+            companies = (mask >> (2 * self.n + 1)) & self.all
+            company_priority = min(source_priority, 2)
+            groups = (
+                accepted & companies & self._priority_mask(company_priority), company_priority,
+                accepted & ~companies & self._priority_mask(source_priority), source_priority,
+            )
+        routes = self._routes.get(groups)
+        if routes is not None:
+            return routes
+        routes = {}
+        for j in range(0, len(groups), 2):
+            group, priority = groups[j], groups[j + 1]
+            for i in _iter_bits(group):
+                chat_id = self.subscribers[i].chat_id
+                routes[chat_id] = min(routes.get(chat_id, priority), priority)
+        if len(self._routes) < 4096:
+            self._routes[groups] = routes
+        return routes
+
+# ---------------------------------------------------------------------------
+# Хранилище просмотренных новостей (дедупликация по хешу ссылки)
+# ---------------------------------------------------------------------------
+# Интерфейс минимален и совместим с set: `h in store`, `store.add(h)`.
+# Хеши хранятся с моментом добавления и вычищаются по TTL = NEWS_MAX_AGE,
+# поэтому память/диск не растут бесконечно, а после рестарта бот не
+# пересылает уже отправленные за сутки новости.
+
+# Ключ записи — 16 байт md5 ссылки. Тот же ключ, что уже накоплен в seen_news.sqlite3,
+# только без промежуточной hex-строки
+def link_digest(link: str) -> bytes:
+    return hashlib.md5(link.encode()).digest()
+
+# Граница свежести в виде кортежа (год, месяц, день, ч, мин, с): published_parsed
+# сравнивается с ней напрямую, без datetime на каждую запись
+def stale_cutoff() -> tuple:
+    return (datetime.now() - NEWS_MAX_AGE).timetuple()[:6]
+
+def _hash_key(news_hash) -> bytes:
+    if isinstance(news_hash, bytes):
+        return news_hash
+    try:
+        return bytes.fromhex(news_hash)
+    except ValueError:
+        return hashlib.md5(news_hash.encode()).digest()
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        capacity = max(capacity, 1)
+        # m = -n*ln(p)/ln(2)^2, k = m/n*ln(2)
+        self.num_bits = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.num_hashes = max(int(round(self.num_bits / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.capacity = capacity
+        self.count = 0
+
+    def _positions(self, key: bytes):
+        # Двойное хеширование поверх уже равномерного ключа (md5 и т.п.)
+        if len(key) < 16:
+            key = hashlib.md5(key).digest()
+        h1 = int.from_bytes(key[:8], 'little')
+        h2 = int.from_bytes(key[8:16], 'little') | 1
+        m = self.num_bits
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % m
+
+    def add(self, key: bytes):
+        bits = self.bits
+        for pos in self._positions(key):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: bytes) -> bool:
+        bits = self.bits
+        for pos in self._positions(key):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    @property
+    def saturated(self) -> bool:
+        return self.count > self.capacity
+
+class SeenStore:
+    def __contains__(self, news_hash) -> bool:
+        raise NotImplementedError
+
+    def add(self, news_hash, ts: Optional[float] = None):
+        raise NotImplementedError
+
+    def add_many(self, hashes: Iterable, ts: Optional[float] = None):
+        for h in hashes:
+            self.add(h, ts)
+
+    def evict_expired(self) -> int:
+        return 0
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+class MemorySeenStore(SeenStore):
+    def __init__(self, ttl: timedelta = NEWS_MAX_AGE):
+        self.ttl = ttl.total_seconds()
+        # dict сохраняет порядок вставки, поэтому вытеснение идёт с головы
+        self._items: Dict[bytes, float] = {}
+
+    def __contains__(self, news_hash) -> bool:
+        return _hash_key(news_hash) in self._items
+
+    def add(self, news_hash, ts: Optional[float] = None):
+        key = _hash_key(news_hash)
+        self._items.pop(key, None)
+        self._items[key] = ts if ts is not None else time.time()
+
+    def evict_expired(self) -> int:
+        cutoff = time.time() - self.ttl
+        expired = []
+        for key, ts in self._items.items():
+            if ts >= cutoff:
+                break
+            expired.append(key)
+        for key in expired:
+            del self._items[key]
+        return len(expired)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+@dataclass
+class BloomGeneration:
+    bloom: BloomFilter
+    started: float
+    newest: float = 0.0  # ts самой свежей записи поколения
+
+# Bloom-фильтр из поколений: новые хеши пишутся в последнее, а поколение
+# выбрасывается целиком, когда все его записи старше TTL. Вытеснение из
+# sqlite не требует перестройки фильтра. Записи, накопленные до запуска,
+# читаются в отдельном потоке; пока он не закончил, проверка идёт в sqlite
+class SqliteSeenStore(SeenStore):
+    COMMIT_EVERY = 500
+
+    def __init__(self, path: str = SEEN_DB_PATH, ttl: timedelta = NEWS_MAX_AGE, bloom_capacity: int = SEEN_BLOOM_CAPACITY):
+        self.path = path
+        self.ttl = ttl.total_seconds()
+        self.bloom_capacity = bloom_capacity
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS seen (hash BLOB PRIMARY KEY, ts REAL NOT NULL) WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS seen_ts ON seen(ts)")
+        self.conn.commit()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.generations: List[BloomGeneration] = []
+        self.bloom_ready = threading.Event()
+        self.evict_expired()
+        if bloom_capacity > 0:
+            # Поколение для новых записей заводится до чтения таблицы: всё, что
+            # добавится во время загрузки, попадёт в него
+            self._new_generation()
+            self._loader = threading.Thread(target=self._load_bloom, name='seen-bloom', daemon=True)
+            self._loader.start()
+
+    def _new_generation(self) -> BloomGeneration:
+        generation = BloomGeneration(BloomFilter(self.bloom_capacity), time.time())
+        with self._lock:
+            self.generations = self.generations + [generation]
+        return generation
+
+    def _load_bloom(self):
+        try:
+            conn = sqlite3.connect(self.path)
+            try:
+                total, newest = conn.execute("SELECT COUNT(*), MAX(ts) FROM seen").fetchone()
+                bloom = BloomFilter(max(self.bloom_capacity, total))
+                for (key,) in conn.execute("SELECT hash FROM seen"):
+                    bloom.add(key)
+            finally:
+                conn.close()
+        except Exception as e:
+            logging.error(f"Bloom-фильтр просмотренных не загружен, проверка идёт в sqlite: {e}")
+            return
+        with self._lock:
+            self.generations = [BloomGeneration(bloom, 0.0, newest or 0.0)] + self.generations
+        self.bloom_ready.set()
+
+    def __contains__(self, news_hash) -> bool:
+        key = _hash_key(news_hash)
+        # Bloom-фильтр отсекает подавляющее большинство новых хешей без обращения к диску
+        if self.bloom_ready.is_set() and not any(key in g.bloom for g in self.generations):
+            return False
+        row = self.conn.execute("SELECT 1 FROM seen WHERE hash = ?", (key,)).fetchone()
+        return row is not None
+
+    def add(self, news_hash, ts: Optional[float] = None):
+        self.add_many((news_hash,), ts)
+
+    def add_many(self, hashes: Iterable, ts: Optional[float] = None):
+        ts = ts if ts is not None else time.time()
+        keys = [_hash_key(h) for h in hashes]
+        self.conn.executemany("INSERT OR REPLACE INTO seen (hash, ts) VALUES (?, ?)", ((k, ts) for k in keys))
+        if self.generations:
+            generation = self.generations[-1]
+            # Заполненное или слишком старое поколение сменяется новым, чтобы старые уходили по TTL
+            if generation.bloom.saturated or time.time() - generation.started > self.ttl / 2:
+                generation = self._new_generation()
+            for key in keys:
+                generation.bloom.add(key)
+            generation.newest = max(generation.newest, ts)
+        self._pending += len(keys)
+        if self._pending >= self.COMMIT_EVERY:
+            self.flush()
+
+    def evict_expired(self) -> int:
+        cutoff = time.time() - self.ttl
+        cur = self.conn.execute("DELETE FROM seen WHERE ts < ?", (cutoff,))
+        self.conn.commit()
+        self._pending = 0
+        # Из Bloom-фильтра удалять нельзя — выбрасываем поколения, где все записи устарели.
+        # Последнее поколение остаётся: в него пишутся новые хеши
+        with self._lock:
+            generations = self.generations
+            self.generations = [g for g in generations[:-1] if g.newest >= cutoff] + generations[-1:]
+        return cur.rowcount
+
+    def flush(self):
+        if self._pending:
+            self.conn.commit()
+            self._pending = 0
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM seen").fetchone()[0]
+
+def create_seen_store(kind: str = SEEN_STORE) -> SeenStore:
+    if kind == 'memory':
+        return MemorySeenStore()
+    try:
+        return SqliteSeenStore()
+    except Exception as e:
+        logging.error(f"Не удалось открыть хранилище просмотренных новостей {SEEN_DB_PATH}: {e}. Использую память")
+        return MemorySeenStore()
+
+# ---------------------------------------------------------------------------
+# Кеш условных запросов к лентам
+# ---------------------------------------------------------------------------
+# Для каждого URL запоминаем ETag, Last-Modified и sha1 тела ответа.
+# Повторный запрос отправляется с If-None-Match / If-Modified-Since;
+# на 304 или совпадающее тело ленту не разбираем вовсе.
+
+class FeedCache:
+    def __init__(self, path: str = FEED_CACHE_PATH):
+        self.path = path
+        self.entries: Dict[str, dict] = self.load()
+        # source_name -> {'not_modified': n, 'unchanged': n, 'miss': n}
+        self.stats: Dict[str, Dict[str, int]] = {}
+        self.dirty = False
+
+    def load(self) -> Dict[str, dict]:
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                logging.error(f"Ошибка загрузки кеша лент: {e}")
+        return {}
+
+    def save(self):
+        if not self.dirty:
+            return
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+        except Exception as e:
+            logging.error(f"Ошибка сохранения кеша лент: {e}")
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        entry = self.entries.get(url)
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def _count(self, source_name: str, kind: str):
+        counters = self.stats.setdefault(source_name, {'not_modified': 0, 'unchanged': 0, 'miss': 0})
+        counters[kind] += 1
+        FEED_CACHE_RESULTS.inc(source_name, kind)
+
+    def record_not_modified(self, source_name: str):
+        self._count(source_name, 'not_modified')
+
+    # Запоминает валидаторы ответа; True — тело не изменилось с прошлого раза
+    def check_body(self, source_name: str, url: str, response_headers, body: bytes) -> bool:
+        digest = hashlib.sha1(body).hexdigest()
+        old = self.entries.get(url, {})
+        entry = {
+            'etag': response_headers.get('ETag'),
+            'last_modified': response_headers.get('Last-Modified'),
+            'digest': digest,
+        }
+        if entry != old:
+            self.entries[url] = entry
+            self.dirty = True
+        if old.get('digest') == digest:
+            self._count(source_name, 'unchanged')
             return True
-    return False
+        self._count(source_name, 'miss')
+        return False
+
+    # То же тело, что и в прошлый раз; в отличие от check_body кеш не меняет
+    def same_body(self, url: str, body: bytes) -> bool:
+        old = self.entries.get(url)
+        return old is not None and old.get('digest') == hashlib.sha1(body).hexdigest()
+
+    # Следующий запрос к этим URL пойдёт без валидаторов и тело не сочтётся неизменным
+    def forget(self, urls: Iterable[str]):
+        for url in urls:
+            if self.entries.pop(url, None) is not None:
+                self.dirty = True
+
+    def hit_rate(self, source_name: str) -> float:
+        counters = self.stats.get(source_name)
+        if not counters:
+            return 0.0
+        hits = counters['not_modified'] + counters['unchanged']
+        return hits / max(hits + counters['miss'], 1)
+
+# ---------------------------------------------------------------------------
+# Потоковый разбор RSS/Atom
+# ---------------------------------------------------------------------------
+# XMLPullParser получает ответ кусками и отдаёт записи по мере закрытия
+# <item>/<entry>; обработанные элементы очищаются, так что полные тексты
+# статей (например, в full.rss РБК) не копятся в памяти. Записи — dict с
+# теми же ключами, что у feedparser: title, link, description, published_parsed.
+# На невалидном XML вызывающий код откатывается на feedparser.
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1] if '}' in tag else tag
+
+def parse_feed_date(value: str) -> Optional[time.struct_time]:
+    value = (value or '').strip()
+    if not value:
+        return None
+    try:
+        dt = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        try:
+            dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    # как feedparser: struct_time в UTC
+    return dt.astimezone(timezone.utc).timetuple()
+
+class StreamingFeedParser:
+    ENTRY_TAGS = {'item', 'entry'}
+    DATE_TAGS = ('pubDate', 'published', 'updated', 'date')
+    DESCRIPTION_TAGS = ('description', 'summary')
+
+    def __init__(self):
+        self.parser = ET.XMLPullParser(events=('end',))
+
+    # Возвращает записи, завершившиеся в этом куске; ET.ParseError — невалидный XML
+    def feed(self, chunk: bytes) -> List[dict]:
+        self.parser.feed(chunk)
+        return self._drain()
+
+    def close(self) -> List[dict]:
+        self.parser.close()
+        return self._drain()
+
+    def _drain(self) -> List[dict]:
+        entries = []
+        for _, elem in self.parser.read_events():
+            if _local_name(elem.tag) in self.ENTRY_TAGS:
+                entries.append(self._entry(elem))
+                elem.clear()
+        return entries
+
+    def _entry(self, elem) -> dict:
+        fields: Dict[str, str] = {}
+        link = ''
+        for child in elem:
+            name = _local_name(child.tag)
+            if name == 'link':
+                # RSS: текст элемента; Atom: href, предпочитаем rel="alternate"
+                href = child.get('href')
+                if href is None:
+                    link = link or (child.text or '').strip()
+                elif child.get('rel', 'alternate') == 'alternate' or not link:
+                    link = href.strip()
+            elif name not in fields:
+                fields[name] = ''.join(child.itertext()).strip()
+        published = None
+        for name in self.DATE_TAGS:
+            if fields.get(name):
+                published = parse_feed_date(fields[name])
+                if published:
+                    break
+        description = next((fields[name] for name in self.DESCRIPTION_TAGS if fields.get(name)), '')
+        return {
+            'title': fields.get('title', ''),
+            'link': link,
+            'description': description,
+            'published_parsed': published,
+        }
 
 @dataclass
+class StreamedFeed:
+    entries: List[dict]
+    prefix: bytes
+    bytes_read: int
+    complete: bool = False   # дочитана до конца, а не остановлена на известной записи
+    fallback: bool = False   # не XML, разобрана feedparser'ом целиком
+    unchanged: bool = False  # начало тела совпало с прошлым ответом, разбор пропущен
+
+    @property
+    def outcome(self) -> str:
+        if self.unchanged:
+            return 'unchanged'
+        if self.fallback:
+            return 'fallback'
+        return 'complete' if self.complete else 'stopped'
+
+# Разбор целых лент feedparser'ом в пуле. Записи возвращаются простыми словарями
+# с нужными полями: их дешевле передавать между процессами, чем FeedParserDict
+def parse_feeds(feeds: List[tuple]) -> List[List[dict]]:
+    results = []
+    for body, response_headers in feeds:
+        try:
+            parsed = feedparser.parse(body, response_headers=response_headers)
+        except Exception as e:
+            logging.error(f"Ошибка разбора ленты: {e}")
+            results.append([])
+            continue
+        entries = []
+        for entry in parsed.entries[:FEED_MAX_ENTRIES]:
+            published = entry.get('published_parsed')
+            entries.append({
+                'title': entry.get('title', ''),
+                'link': entry.get('link', ''),
+                'description': entry.get('description', ''),
+                'published_parsed': tuple(published) if published else None,
+            })
+        results.append(entries)
+    return results
+
+# ---------------------------------------------------------------------------
+# Здоровье URL лент и предохранитель (circuit breaker)
+# ---------------------------------------------------------------------------
+# Для каждого URL копим успехи/ошибки, сглаженную задержку и последнюю
+# ошибку. После BREAKER_FAILURE_THRESHOLD ошибок подряд URL «размыкается»
+# и не запрашивается до конца остывания (время растёт при повторных
+# срабатываниях). Порядок зеркал — от самого быстрого здорового.
+
+class FetchError(Exception):
+    pass
+
+@dataclass
+class UrlHealth:
+    successes: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    trips: int = 0
+    latency: Optional[float] = None
+    last_error: Optional[str] = None
+    last_success: Optional[float] = None
+    open_until: float = 0.0
+
+    @property
+    def success_rate(self) -> float:
+        total = self.successes + self.failures
+        return self.successes / total if total else 1.0
+
+class MirrorHealth:
+    LATENCY_ALPHA = 0.3
+    MAX_COOLDOWN_SEC = 3600
+
+    def __init__(self, path: str = MIRROR_HEALTH_PATH):
+        self.path = path
+        self.urls: Dict[str, UrlHealth] = self.load()
+        self.dirty = False
+
+    def load(self) -> Dict[str, UrlHealth]:
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    return {url: UrlHealth(**data) for url, data in json.load(f).items()}
+            except Exception as e:
+                logging.error(f"Ошибка загрузки состояния зеркал: {e}")
+        return {}
+
+    def save(self):
+        if not self.dirty:
+            return
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({url: asdict(h) for url, h in self.urls.items()}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+        except Exception as e:
+            logging.error(f"Ошибка сохранения состояния зеркал: {e}")
+
+    def get(self, url: str) -> UrlHealth:
+        health = self.urls.get(url)
+        if health is None:
+            health = self.urls[url] = UrlHealth()
+        return health
+
+    def record_success(self, url: str, latency: float):
+        h = self.get(url)
+        h.successes += 1
+        h.consecutive_failures = 0
+        h.trips = 0
+        h.open_until = 0.0
+        h.last_success = time.time()
+        h.latency = latency if h.latency is None else h.latency + self.LATENCY_ALPHA * (latency - h.latency)
+        self.dirty = True
+
+    def record_failure(self, url: str, error: str):
+        h = self.get(url)
+        h.failures += 1
+        h.consecutive_failures += 1
+        h.last_error = error
+        if h.consecutive_failures >= BREAKER_FAILURE_THRESHOLD:
+            h.trips += 1
+            cooldown = min(BREAKER_COOLDOWN_SEC * (2 ** (h.trips - 1)), self.MAX_COOLDOWN_SEC)
+            h.open_until = time.time() + cooldown
+            h.consecutive_failures = 0
+            logging.warning(f"⛔ Предохранитель для {url}: пропуск на {cooldown:.0f} с (ошибка: {error})")
+        self.dirty = True
+
+    def is_open(self, url: str) -> bool:
+        h = self.urls.get(url)
+        return h is not None and h.open_until > time.time()
+
+    def _score(self, url: str) -> float:
+        h = self.urls.get(url)
+        if h is None or h.latency is None:
+            return HEDGE_DELAY_SEC
+        return h.latency / max(h.success_rate, 0.1)
+
+    # Порядок попыток: разомкнутые URL отбрасываются (если разомкнуты все —
+    # пробуем тот, чьё остывание кончится раньше), остальные — по скорости
+    def rank(self, urls: List[str]) -> List[str]:
+        healthy = [u for u in urls if not self.is_open(u)]
+        if not healthy:
+            return sorted(urls, key=lambda u: self.get(u).open_until)[:1]
+        return sorted(healthy, key=self._score)
+
+    def hedge_delay(self, url: str) -> float:
+        h = self.urls.get(url)
+        if h is None or h.latency is None:
+            return HEDGE_DELAY_SEC
+        return max(HEDGE_DELAY_SEC, h.latency * 2)
+
+    def summary_lines(self) -> List[str]:
+        now = time.time()
+        lines = []
+        for url, h in sorted(self.urls.items()):
+            state = f"OPEN ещё {h.open_until - now:.0f}с" if h.open_until > now else "ok"
+            latency = f"{h.latency * 1000:.0f}мс" if h.latency is not None else "—"
+            error = f", ошибка: {h.last_error}" if h.last_error and h.open_until > now else ""
+            lines.append(f"{url}: {state}, успех {h.success_rate:.0%}, задержка {latency}{error}")
+        return lines
+
+# slots: без __dict__ на каждую запись; hash — 16 байт (link_digest), а не hex-строка
+@dataclass(slots=True)
 class NewsItem:
     title: str
     url: str
@@ -125,20 +1595,821 @@ class NewsItem:
     priority: int
     category: str
     timestamp: datetime
-    hash: str
+    hash: bytes
     via_mirror: bool = False  # получена через зеркало (alt_urls), например Google News
+    routes: Dict[str, int] = field(default_factory=dict)  # chat_id -> приоритет для этого чата
+
+# ---------------------------------------------------------------------------
+# Склейка дублей историй из разных источников
+# ---------------------------------------------------------------------------
+# Одно событие приходит от Интерфакса, РБК, Коммерсанта и зеркал Google News
+# с разными ссылками. По леммам заголовка строим MinHash-сигнатуру и ищем
+# похожие истории в LSH-индексе за скользящее окно. Стоимость на запись
+# постоянна: фиксированное число корзин и ограниченное число кандидатов.
+
+DUPLICATE_STOPWORDS = frozenset({
+    'в', 'во', 'на', 'и', 'о', 'об', 'по', 'с', 'со', 'за', 'до', 'из', 'к', 'ко', 'от', 'для',
+    'не', 'что', 'как', 'а', 'но', 'у', 'при', 'про', 'после', 'над', 'под', 'же', 'ли', 'бы',
+    'это', 'он', 'она', 'они', 'его', 'ее', 'их', 'год', 'быть', 'мочь', 'который', 'свой',
+})
+
+def story_tokens(lemmas: Iterable[str]) -> frozenset:
+    return frozenset(t for t in lemmas if t not in DUPLICATE_STOPWORDS and (len(t) > 1 or t.isdigit()))
+
+# Однотипные заголовки о разных событиях («Сбербанк/ВТБ отчитался о прибыли»,
+# «ЦБ повысил/снизил ставку») по леммам почти совпадают, поэтому кандидата из
+# индекса дополнительно сверяем: в заголовках не должно быть разных компаний
+# и противоположных действий
+DUPLICATE_OPPOSITES = (
+    (frozenset({'повысить', 'поднять', 'подняться', 'вырасти', 'увеличить', 'увеличиться', 'подорожать',
+                'ускорить', 'ускориться', 'укрепиться'}),
+     frozenset({'снизить', 'снизиться', 'понизить', 'упасть', 'сократить', 'сократиться', 'подешеветь',
+                'опуститься', 'замедлить', 'замедлиться', 'уменьшить', 'уменьшиться', 'ослабнуть'})),
+    (frozenset({'приостановить', 'остановить', 'прекратить'}),
+     frozenset({'возобновить', 'возобновиться'})),
+)
+# Разные названия одного участника рынка приводим к одному
+DUPLICATE_ALIASES = [(re.compile(pattern, re.IGNORECASE), name) for pattern, name in (
+    (r'\bбанк\w* росси\w*', 'ЦБ'),
+    (r'\bцентробанк\w*', 'ЦБ'),
+    (r'\bцентральн\w* банк\w*', 'ЦБ'),
+    (r'\bевросоюз\w*', 'ЕС'),
+    (r'\bмосковск\w* бирж\w*', 'Мосбиржа'),
+)]
+# Имена собственные, аббревиатуры и тикеры: слова с заглавной буквы
+ENTITY_RE = re.compile(r'\b[A-ZА-ЯЁ][\w-]*')
+# Подпись источника в конце заголовка из Google News: «… - РБК»
+SOURCE_SUFFIX_RE = re.compile(r'\s+[-–—]\s+[^-–—]+$')
+
+@dataclass(frozen=True)
+class StoryAnchors:
+    text: str              # заголовок в нижнем регистре, с приведёнными названиями
+    entities: frozenset    # первые 4 буквы имён собственных
+    actions: frozenset     # (номер пары из DUPLICATE_OPPOSITES, сторона)
+
+    @classmethod
+    def build(cls, title: str, tokens: frozenset) -> "StoryAnchors":
+        title = SOURCE_SUFFIX_RE.sub('', title)
+        for pattern, name in DUPLICATE_ALIASES:
+            title = pattern.sub(name, title)
+        entities = frozenset(word.lower()[:4] for word in ENTITY_RE.findall(title))
+        actions = frozenset((i, side) for i, pair in enumerate(DUPLICATE_OPPOSITES)
+                            for side, verbs in enumerate(pair) if tokens & verbs)
+        return cls(title.lower(), entities, actions)
+
+    # Компания, которой нет в другом заголовке, есть у обоих — значит, речь о разных компаниях;
+    # слово с заглавной в начале заголовка («Чистая прибыль…») встречается в другом и не мешает
+    def conflicts(self, other: "StoryAnchors") -> bool:
+        if any(e not in other.text for e in self.entities) and any(e not in self.text for e in other.entities):
+            return True
+        for i in range(len(DUPLICATE_OPPOSITES)):
+            mine = {side for j, side in self.actions if j == i}
+            theirs = {side for j, side in other.actions if j == i}
+            if len(mine) == 1 and len(theirs) == 1 and mine != theirs:
+                return True
+        return False
+
+@dataclass
+class StoryCluster:
+    news: "NewsItem"
+    signature: tuple
+    created: float
+    keys: List[tuple]
+    anchors: Optional[StoryAnchors] = None
+    sources: List[str] = field(default_factory=list)
+    # chat_id -> (копия истории, отправленная в чат, её сообщение)
+    deliveries: Dict[str, tuple] = field(default_factory=dict)
+
+class StoryIndex:
+    MERSENNE_PRIME = (1 << 61) - 1
+    MAX_CANDIDATES = 50
+
+    def __init__(self, window_sec: float = DUPLICATE_WINDOW_HOURS * 3600, threshold: float = DUPLICATE_THRESHOLD,
+                 num_perm: int = 64, rows: int = 2, seed: int = 1):
+        self.window = window_sec
+        self.threshold = threshold
+        self.rows = rows
+        self.bands = num_perm // rows
+        rnd = random.Random(seed)
+        self.perms = [(rnd.randrange(1, self.MERSENNE_PRIME), rnd.randrange(0, self.MERSENNE_PRIME)) for _ in range(num_perm)]
+        self.buckets: Dict[tuple, List[StoryCluster]] = {}
+        self.clusters: deque = deque()
+
+    def signature(self, tokens: Iterable[str]) -> tuple:
+        hashes = [int.from_bytes(hashlib.blake2b(t.encode(), digest_size=8).digest(), 'little') for t in tokens]
+        if not hashes:
+            return ()
+        p = self.MERSENNE_PRIME
+        return tuple(min((a * h + b) % p for h in hashes) for a, b in self.perms)
+
+    def _band_keys(self, signature: tuple) -> List[tuple]:
+        r = self.rows
+        return [(i, signature[i * r:(i + 1) * r]) for i in range(self.bands)]
+
+    @staticmethod
+    def similarity(a: tuple, b: tuple) -> float:
+        return sum(1 for x, y in zip(a, b) if x == y) / len(a) if a and b else 0.0
+
+    def _evict(self, now: float):
+        while self.clusters and now - self.clusters[0].created > self.window:
+            cluster = self.clusters.popleft()
+            for key in cluster.keys:
+                bucket = self.buckets.get(key)
+                if bucket is not None:
+                    try:
+                        bucket.remove(cluster)
+                    except ValueError:
+                        pass
+                    if not bucket:
+                        del self.buckets[key]
+
+    # Похожая история в окне или None; кандидаты с другой компанией или
+    # противоположным действием в заголовке (anchors) пропускаются
+    def match(self, signature: tuple, now: Optional[float] = None,
+              anchors: Optional[StoryAnchors] = None) -> Optional[StoryCluster]:
+        if not signature:
+            return None
+        self._evict(now if now is not None else time.monotonic())
+        best, best_score = None, self.threshold
+        seen_ids = set()
+        checked = 0
+        for key in self._band_keys(signature):
+            for cluster in reversed(self.buckets.get(key, ())):
+                if id(cluster) in seen_ids:
+                    continue
+                seen_ids.add(id(cluster))
+                score = self.similarity(signature, cluster.signature)
+                if score >= best_score and not (anchors and cluster.anchors and anchors.conflicts(cluster.anchors)):
+                    best, best_score = cluster, score
+                checked += 1
+                if checked >= self.MAX_CANDIDATES:
+                    return best
+        return best
+
+    def add(self, news: "NewsItem", signature: tuple, now: Optional[float] = None,
+            anchors: Optional[StoryAnchors] = None) -> StoryCluster:
+        keys = self._band_keys(signature) if signature else []
+        cluster = StoryCluster(news, signature, now if now is not None else time.monotonic(), keys, anchors, [news.source])
+        for key in keys:
+            self.buckets.setdefault(key, []).append(cluster)
+        self.clusters.append(cluster)
+        return cluster
+
+    def __len__(self) -> int:
+        return len(self.clusters)
+
+# ---------------------------------------------------------------------------
+# Доставка в Telegram
+# ---------------------------------------------------------------------------
+# Поллеры только кладут сообщения в очередь с приоритетом; отдельный воркер
+# отправляет их, соблюдая лимиты Telegram (token bucket на чат и глобально),
+# учитывает retry_after из ответа 429 и повторяет неудачные отправки.
+# Неотправленные сообщения лежат в sqlite и переживают перезапуск.
+
+class TokenBucket:
+    def __init__(self, rate_per_sec: float, capacity: float):
+        self.rate = rate_per_sec
+        self.capacity = max(capacity, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Сколько секунд ждать до появления жетона (0 — можно отправлять)
+    def delay(self) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(self.blocked_until - now, 0.0)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate if self.rate > 0 else 60.0)
+        return wait
+
+    def consume(self):
+        self._refill(time.monotonic())
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+@dataclass(order=True)
+class OutgoingMessage:
+    priority: int
+    seq: int
+    chat_id: str = field(compare=False)
+    text: str = field(compare=False)
+    outbox_id: Optional[int] = field(default=None, compare=False)
+    attempts: int = field(default=0, compare=False)
+    not_before: float = field(default=0.0, compare=False)
+    enqueued_at: float = field(default_factory=time.monotonic, compare=False)
+
+# Как и хранилище просмотренных: WAL и фиксация пачками. Изменения коммитятся
+# раз в опрос источника, когда очередь доставки простаивает, или каждые
+# COMMIT_EVERY изменений. После падения незафиксированное удаление лишь
+# повторит отправку, а незафиксированное добавление ограничено одним опросом
+class Outbox:
+    COMMIT_EVERY = 100
+
+    def __init__(self, path: str = OUTBOX_DB_PATH):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id TEXT NOT NULL, "
+            "priority INTEGER NOT NULL, text TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self.conn.commit()
+        self._pending = 0
+
+    def _changed(self, count: int = 1):
+        self._pending += count
+        if self._pending >= self.COMMIT_EVERY:
+            self.flush()
+
+    def add(self, chat_id: str, priority: int, text: str) -> int:
+        cur = self.conn.execute(
+            "INSERT INTO outbox (chat_id, priority, text, created) VALUES (?, ?, ?, ?)",
+            (chat_id, priority, text, time.time()),
+        )
+        self._changed()
+        return cur.lastrowid
+
+    def remove(self, ids: List[int]):
+        if ids:
+            self.conn.executemany("DELETE FROM outbox WHERE id = ?", ((i,) for i in ids))
+            self._changed(len(ids))
+
+    def update(self, outbox_id: int, priority: int, text: str):
+        self.conn.execute("UPDATE outbox SET priority = ?, text = ? WHERE id = ?", (priority, text, outbox_id))
+        self._changed()
+
+    def flush(self):
+        if self._pending:
+            self.conn.commit()
+            self._pending = 0
+
+    def pending(self) -> List[tuple]:
+        return self.conn.execute("SELECT id, chat_id, priority, text FROM outbox ORDER BY id").fetchall()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+class DeliveryQueue:
+    MAX_BACKOFF_SEC = 300
+
+    def __init__(self, bot_token: str, outbox: Optional[Outbox] = None, api_url: str = TELEGRAM_API_URL):
+        self.url = f"{api_url}/bot{bot_token}/sendMessage"
+        self.outbox = outbox
+        self.heap: List[OutgoingMessage] = []
+        self.seq = itertools.count()
+        self.global_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE_PER_SEC, TELEGRAM_GLOBAL_RATE_PER_SEC)
+        self.chat_buckets: Dict[str, TokenBucket] = {}
+        self.in_flight: Set[str] = set()
+        self.wakeup = asyncio.Event()
+        self.semaphore = asyncio.Semaphore(DELIVERY_CONCURRENCY)
+        self.is_running = False
+        self.queued = 0
+        self.sent = 0
+        self.failed = 0
+        if outbox is not None:
+            for outbox_id, chat_id, priority, text in outbox.pending():
+                self._push(OutgoingMessage(priority, next(self.seq), chat_id, text, outbox_id))
+            if self.heap:
+                logging.info(f"📬 Восстановлено неотправленных сообщений: {len(self.heap)}")
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def _push(self, message: OutgoingMessage):
+        heapq.heappush(self.heap, message)
+        self.wakeup.set()
+
+    def put(self, chat_id: str, priority: int, text: str) -> OutgoingMessage:
+        outbox_id = self.outbox.add(chat_id, priority, text) if self.outbox is not None else None
+        message = OutgoingMessage(priority, next(self.seq), chat_id, text, outbox_id)
+        self._push(message)
+        self.queued += 1
+        return message
+
+    # Меняет ещё не отправленное сообщение; False — оно уже ушло или отправляется
+    def update(self, message: OutgoingMessage, text: str, priority: int) -> bool:
+        if not any(m is message for m in self.heap):
+            return False
+        message.text = text
+        message.priority = priority
+        heapq.heapify(self.heap)
+        if self.outbox is not None and message.outbox_id is not None:
+            self.outbox.update(message.outbox_id, priority, text)
+        return True
+
+    def _bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(TELEGRAM_CHAT_RATE_PER_MIN / 60, TELEGRAM_CHAT_BURST)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    # Самое приоритетное сообщение, чей чат сейчас можно отправлять; иначе — сколько ждать
+    def _pop_ready(self):
+        skipped = []
+        ready = None
+        wait = 60.0
+        now = time.monotonic()
+        while self.heap:
+            message = heapq.heappop(self.heap)
+            chat_wait = self._bucket(message.chat_id).delay()
+            if message.chat_id in self.in_flight:
+                chat_wait = max(chat_wait, 0.05)
+            chat_wait = max(chat_wait, message.not_before - now)
+            if chat_wait <= 0:
+                ready = message
+                break
+            wait = min(wait, chat_wait)
+            skipped.append(message)
+        for message in skipped:
+            heapq.heappush(self.heap, message)
+        return ready, wait
+
+    # Склеивает низкоприоритетные сообщения того же чата в один дайджест
+    def _collect_digest(self, first: OutgoingMessage) -> List[OutgoingMessage]:
+        if not DIGEST_MIN_PRIORITY or first.priority < DIGEST_MIN_PRIORITY:
+            return [first]
+        batch = [first]
+        length = len(first.text)
+        rest = []
+        for message in sorted(self.heap):
+            if (len(batch) < DIGEST_MAX_ITEMS and message.chat_id == first.chat_id
+                    and message.priority >= DIGEST_MIN_PRIORITY
+                    and length + len(message.text) + 2 < TELEGRAM_MAX_MESSAGE_LEN - 64):
+                batch.append(message)
+                length += len(message.text) + 2
+            else:
+                rest.append(message)
+        if len(batch) > 1:
+            self.heap = rest
+            heapq.heapify(self.heap)
+        return batch
+
+    async def run(self, session: aiohttp.ClientSession):
+        self.is_running = True
+        tasks: Set[asyncio.Task] = set()
+        while self.is_running:
+            ready, wait = self._pop_ready()
+            if ready is None:
+                self.flush()
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=wait if self.heap else None)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            global_wait = self.global_bucket.delay()
+            if global_wait > 0:
+                self._push(ready)
+                await asyncio.sleep(global_wait)
+                continue
+            batch = self._collect_digest(ready)
+            self.global_bucket.consume()
+            self._bucket(ready.chat_id).consume()
+            self.in_flight.add(ready.chat_id)
+            await self.semaphore.acquire()
+            task = asyncio.create_task(self._deliver(session, batch))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        for task in list(tasks):
+            task.cancel()
+
+    def stop(self):
+        self.is_running = False
+        self.wakeup.set()
+
+    def flush(self):
+        if self.outbox is not None:
+            self.outbox.flush()
+
+    async def _deliver(self, session: aiohttp.ClientSession, batch: List[OutgoingMessage]):
+        head = batch[0]
+        try:
+            if len(batch) > 1:
+                text = f"📋 <b>Дайджест ({len(batch)})</b>\n\n" + "\n\n".join(m.text for m in batch)
+            else:
+                text = head.text
+            data = {
+                'chat_id': head.chat_id,
+                'text': text,
+                'parse_mode': 'HTML',
+                'disable_web_page_preview': True
+            }
+            retry_after = None
+            permanent = False
+            try:
+                started = time.perf_counter()
+                async with session.post(self.url, json=data) as response:
+                    TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - started)
+                    TELEGRAM_RESPONSES.inc(str(response.status))
+                    if response.status == 200:
+                        self.sent += len(batch)
+                        if self.outbox is not None:
+                            self.outbox.remove([m.outbox_id for m in batch if m.outbox_id is not None])
+                        logging.info(f"✅ Сообщение отправлено" + (f" (дайджест из {len(batch)})" if len(batch) > 1 else ""))
+                        return
+                    body = await response.text()
+                    if response.status == 429:
+                        try:
+                            retry_after = float(json.loads(body).get('parameters', {}).get('retry_after', 1))
+                        except Exception:
+                            retry_after = 1.0
+                        logging.warning(f"Telegram 429: пауза {retry_after:.0f} с для чата {head.chat_id}")
+                    else:
+                        # 400/403 повторять бессмысленно (битая разметка, бот удалён из чата)
+                        permanent = response.status in (400, 403)
+                        logging.error(f"Ошибка отправки в Telegram (HTTP {response.status}): {body}")
+            except Exception as e:
+                TELEGRAM_RESPONSES.inc('error')
+                logging.error(f"Ошибка отправки сообщения: {e}")
+
+            if permanent:
+                self.failed += len(batch)
+                if self.outbox is not None:
+                    self.outbox.remove([m.outbox_id for m in batch if m.outbox_id is not None])
+                return
+            if retry_after is not None:
+                self._bucket(head.chat_id).block(retry_after)
+            for message in batch:
+                if retry_after is None:
+                    message.attempts += 1
+                    backoff = min(BASE_BACKOFF_SEC * (2 ** message.attempts), self.MAX_BACKOFF_SEC)
+                    message.not_before = time.monotonic() + backoff
+                self._push(message)
+        finally:
+            self.in_flight.discard(head.chat_id)
+            self.semaphore.release()
+            self.wakeup.set()
+
+# ---------------------------------------------------------------------------
+# Планировщик опроса источников
+# ---------------------------------------------------------------------------
+# Каждый источник опрашивается по своему расписанию. Интервал сокращается,
+# когда в ленте появляются новые записи, и растёт, пока лента молчит;
+# нижняя граница зависит от приоритета источника (или poll_interval_sec в
+# конфиге). Новыми считаются записи, которых не было в ленте раньше, — до
+# ключевых слов и фильтров, иначе отфильтрованная лента всегда выглядит
+# молчащей. Медленный источник опрашивается в своей задаче и не задерживает
+# остальные.
+
+# Множители нижней, стартовой и верхней границы интервала по приоритету
+# источника; важные источники не отступают дальше базового интервала (или
+# его небольшого кратного), остальные — до MAX_POLL_INTERVAL_SEC
+PRIORITY_MIN_INTERVAL_FACTOR = {1: 0.25, 2: 0.5}
+PRIORITY_START_INTERVAL_FACTOR = {1: 0.5, 2: 1.0}
+PRIORITY_MAX_INTERVAL_FACTOR = {1: 1.0, 2: 2.0}
+# Сколько ссылок ленты помнить, чтобы отличать новые записи от уже виденных
+SCHEDULE_KNOWN_LINKS = 1000
+POLL_SPEEDUP = 0.7
+POLL_BACKOFF = 1.5
+
+@dataclass
+class SourceSchedule:
+    interval: float
+    min_interval: float
+    max_interval: float
+    next_due: float = 0.0
+    in_flight: bool = False
+    polls: int = 0
+    new_items: int = 0
+    last_duration: float = 0.0
+    published: int = 0  # новых записей в ленте с прошлого record()
+    known: Set[bytes] = field(default_factory=set)  # md5 ссылок, уже встречавшихся в ленте
+
+    @classmethod
+    def for_source(cls, source_config: dict, base_interval: float) -> "SourceSchedule":
+        priority = source_config.get('priority', 3)
+        min_interval = source_config.get('poll_interval_sec') or base_interval * PRIORITY_MIN_INTERVAL_FACTOR.get(priority, 1.0)
+        min_interval = max(float(min_interval), MIN_POLL_INTERVAL_SEC)
+        start = max(base_interval * PRIORITY_START_INTERVAL_FACTOR.get(priority, 1.5), min_interval)
+        factor = PRIORITY_MAX_INTERVAL_FACTOR.get(priority)
+        max_interval = base_interval * factor if factor else MAX_POLL_INTERVAL_SEC
+        return cls(interval=start, min_interval=min_interval, max_interval=max(max_interval, start))
+
+    # Новые границы после перезагрузки конфига; накопленный интервал сохраняется
+    def reconfigure(self, source_config: dict, base_interval: float):
+        fresh = SourceSchedule.for_source(source_config, base_interval)
+        self.min_interval = fresh.min_interval
+        self.max_interval = fresh.max_interval
+        self.interval = min(max(self.interval, self.min_interval), self.max_interval)
+        self.next_due = min(self.next_due, time.monotonic() + self.interval)
+
+    # Записи ленты до фильтров: digests — md5 ссылок записей, которых нет среди просмотренных
+    def observe(self, digests: List[bytes]):
+        new = [d for d in digests if d not in self.known]
+        self.published += len(new)
+        if len(self.known) + len(new) > SCHEDULE_KNOWN_LINKS:
+            self.known = set(digests)
+        else:
+            self.known.update(new)
+
+    def record(self, duration: float):
+        new_count, self.published = self.published, 0
+        self.polls += 1
+        self.new_items += new_count
+        self.last_duration = duration
+        if new_count:
+            self.interval = max(self.min_interval, self.interval * POLL_SPEEDUP)
+        else:
+            self.interval = min(self.max_interval, self.interval * POLL_BACKOFF)
+        self.next_due = time.monotonic() + self.interval
+
+# ---------------------------------------------------------------------------
+# Архив новостей
+# ---------------------------------------------------------------------------
+# Принятые записи дописываются в sqlite: таблица news с индексами по времени,
+# источнику и приоритету плюс FTS5-индекс по словам заголовка и его леммам.
+# FTS-таблица без собственного содержимого (content=''): текст хранится один
+# раз в news, индекс только ссылается на rowid. Запись идёт пакетами в своём
+# потоке с отдельным соединением, чтение — в другом; WAL позволяет им не
+# мешать друг другу. id растёт со временем добавления, поэтому свежие
+# результаты берутся обходом индекса с конца без сортировки.
+
+class NewsArchive:
+    def __init__(self, path: str = ARCHIVE_DB_PATH, flush_interval: float = ARCHIVE_FLUSH_SEC,
+                 batch_size: int = ARCHIVE_BATCH_SIZE):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = max(batch_size, 1)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='archive-write')
+        self._reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='archive-read')
+        self.conn = self._connect()
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS news ("
+            "id INTEGER PRIMARY KEY, ts REAL NOT NULL, source TEXT NOT NULL, priority INTEGER NOT NULL, "
+            "category TEXT NOT NULL, title TEXT NOT NULL, url TEXT NOT NULL, hash TEXT NOT NULL UNIQUE);"
+            "CREATE INDEX IF NOT EXISTS news_ts ON news(ts);"
+            "CREATE INDEX IF NOT EXISTS news_source ON news(source, id);"
+            "CREATE INDEX IF NOT EXISTS news_priority ON news(priority, id);"
+            "CREATE VIRTUAL TABLE IF NOT EXISTS news_fts USING fts5(title, lemmas, content='', "
+            "tokenize='unicode61 remove_diacritics 2');"
+        )
+        self.conn.commit()
+        self.read_conn: Optional[sqlite3.Connection] = None
+        self._pending: List[NewsItem] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # Соединение создаётся в одном потоке, а используется в потоке пула
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def add(self, news_items: List[NewsItem]):
+        self._pending.extend(news_items)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        if len(self._pending) < self.batch_size:
+            await asyncio.sleep(self.flush_interval)
+        while self._pending:
+            batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+            try:
+                await self._write(batch)
+            except Exception as e:
+                logging.error(f"Ошибка записи в архив ({len(batch)} записей): {e}")
+
+    async def _write(self, batch: List[NewsItem]):
+        titles = [news.title for news in batch]
+        # Леммы заголовков почти всегда уже в кеше после склейки дублей
+        lemma_sets = await lemmatizer.alemmatize_batch(titles) if lemmatizer.ready else [frozenset()] * len(batch)
+        rows = [
+            (news.timestamp.timestamp(), news.source, news.priority, news.category, news.title, news.url, news.hash.hex(),
+             " ".join(sorted(lemmas)))
+            for news, lemmas in zip(batch, lemma_sets)
+        ]
+        with ARCHIVE_WRITE_SECONDS.time():
+            added = await asyncio.get_running_loop().run_in_executor(self._writer, self._insert, rows)
+        ARCHIVE_ROWS.inc(value=added)
+
+    def _insert(self, rows: List[tuple]) -> int:
+        added = 0
+        with self.conn:
+            for *row, lemmas in rows:
+                cur = self.conn.execute(
+                    "INSERT OR IGNORE INTO news (ts, source, priority, category, title, url, hash) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    row,
+                )
+                if cur.rowcount:
+                    self.conn.execute("INSERT INTO news_fts (rowid, title, lemmas) VALUES (?, ?, ?)",
+                                      (cur.lastrowid, row[4], lemmas))
+                    added += 1
+        return added
+
+    # Каждое слово запроса: префикс слова в заголовке или его лемма (если модели загружены)
+    @staticmethod
+    def fts_query(words: List[str], lemmas: List[frozenset]) -> str:
+        terms = []
+        for word, forms in zip(words, lemmas):
+            alternatives = [f'title : "{word}" *'] + [f'lemmas : "{lemma}"' for lemma in sorted(forms) if WORD_RE.fullmatch(lemma)]
+            terms.append("(" + " OR ".join(alternatives) + ")")
+        return " AND ".join(terms)
+
+    async def search(self, query: str = "", source: Optional[str] = None, since: Optional[float] = None,
+                     until: Optional[float] = None, max_priority: Optional[int] = None, limit: int = 50) -> List[dict]:
+        words = WORD_RE.findall(query.lower())
+        if words and lemmatizer.ready:
+            lemmas = await lemmatizer.alemmatize_batch(words)
+        else:
+            lemmas = [frozenset()] * len(words)
+        match = self.fts_query(words, lemmas) if words else None
+        with SEARCH_SECONDS.time():
+            return await asyncio.get_running_loop().run_in_executor(
+                self._reader, self._select, match, source, since, until, max_priority, limit
+            )
+
+    def _select(self, match: Optional[str], source: Optional[str], since: Optional[float], until: Optional[float],
+                max_priority: Optional[int], limit: int) -> List[dict]:
+        if self.read_conn is None:
+            self.read_conn = self._connect()
+        conn = self.read_conn
+        where, params = [], []
+        if since is not None:
+            # Запись не может попасть в архив раньше публикации, поэтому всё, что
+            # новее since, лежит не ниже первого id с ts >= since
+            row = conn.execute("SELECT min(id) FROM news INDEXED BY news_ts WHERE ts >= ?", (since,)).fetchone()
+            if row[0] is None:
+                return []
+            where.append("n.id >= ?" if not match else "news_fts.rowid >= ?")
+            params.append(row[0])
+            # Диапазон уже задан по id; «+» не даёт планировщику уйти на индекс по ts с сортировкой
+            where.append("+n.ts >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("+n.ts < ?")
+            params.append(until)
+        if source:
+            where.append("n.source = ?")
+            params.append(source)
+        if max_priority is not None:
+            where.append("n.priority <= ?")
+            params.append(max_priority)
+        columns = "n.ts, n.source, n.priority, n.category, n.title, n.url"
+        if match:
+            sql = (f"SELECT {columns} FROM news_fts JOIN news n ON n.id = news_fts.rowid "
+                   f"WHERE news_fts MATCH ?{''.join(' AND ' + w for w in where)} ORDER BY news_fts.rowid DESC LIMIT ?")
+            params = [match] + params
+        else:
+            sql = f"SELECT {columns} FROM news n{' WHERE ' + ' AND '.join(where) if where else ''} ORDER BY n.id DESC LIMIT ?"
+        params.append(limit)
+        return [
+            {'ts': datetime.fromtimestamp(ts).isoformat(timespec='seconds'), 'source': src, 'priority': prio,
+             'category': category, 'title': title, 'url': url}
+            for ts, src, prio, category, title, url in conn.execute(sql, params)
+        ]
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT count(*) FROM news").fetchone()[0]
+
+    async def close(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        if self._pending:
+            batch, self._pending = self._pending, []
+            await self._write(batch)
+        await asyncio.get_running_loop().run_in_executor(self._writer, self.conn.close)
+        if self.read_conn is not None:
+            await asyncio.get_running_loop().run_in_executor(self._reader, self.read_conn.close)
+        self._writer.shutdown()
+        self._reader.shutdown()
+
+# ---------------------------------------------------------------------------
+# Конфигурация с горячей перезагрузкой
+# ---------------------------------------------------------------------------
+# Источники, фильтры и подписчики вместе с производными структурами
+# (автоматы, маршрутизатор, леммы ключей) живут в одном снимке BotConfig.
+# Новый снимок собирается в фоне, и только потом одним присваиванием
+# подменяет старый. Опрос берёт снимок в начале и работает с ним до конца,
+# поэтому наполовину обновлённого состояния не видит.
+
+class ConfigError(ValueError):
+    pass
+
+def _check_str_list(value, where: str):
+    if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+        raise ConfigError(f"{where}: ожидается список строк")
+
+def validate_sources(sources) -> dict:
+    if not isinstance(sources, dict) or not sources:
+        raise ConfigError("источники: ожидается непустой объект {имя: настройки}")
+    for name, cfg in sources.items():
+        if not isinstance(cfg, dict):
+            raise ConfigError(f"{name}: ожидается объект")
+        if not cfg.get('url') and not cfg.get('alt_urls'):
+            raise ConfigError(f"{name}: нет url")
+        for key in ('url', 'category'):
+            if key in cfg and not isinstance(cfg[key], str):
+                raise ConfigError(f"{name}.{key}: ожидается строка")
+        for key in ('alt_urls', 'keywords'):
+            if key in cfg:
+                _check_str_list(cfg[key], f"{name}.{key}")
+        if not isinstance(cfg.get('priority', 3), int) or not 1 <= cfg.get('priority', 3) <= 4:
+            raise ConfigError(f"{name}.priority: ожидается число от 1 до 4")
+        interval = cfg.get('poll_interval_sec')
+        if interval is not None and (not isinstance(interval, (int, float)) or interval <= 0):
+            raise ConfigError(f"{name}.poll_interval_sec: ожидается положительное число")
+    return sources
+
+def validate_filters(filters) -> dict:
+    if not isinstance(filters, dict):
+        raise ConfigError("фильтры: ожидается объект")
+    for key in ('whitelist', 'blacklist'):
+        _check_str_list(filters.setdefault(key, []), f"фильтры.{key}")
+    return filters
+
+# sources — ключи rss_sources.json: ограничение по неизвестному источнику
+# молча оставило бы чат без новостей
+def validate_subscribers(subscribers, sources: dict) -> dict:
+    if not isinstance(subscribers, dict):
+        raise ConfigError("подписчики: ожидается объект {имя: настройки}")
+    for name, cfg in subscribers.items():
+        if not isinstance(cfg, dict):
+            raise ConfigError(f"{name}: ожидается объект")
+        chat_id = cfg.get('chat_id')
+        if isinstance(chat_id, bool) or not isinstance(chat_id, (str, int)) or chat_id == '':
+            raise ConfigError(f"{name}.chat_id: ожидается строка или число")
+        for key in ('whitelist', 'blacklist', 'tracked_companies', 'sources'):
+            if cfg.get(key) is not None:
+                _check_str_list(cfg[key], f"{name}.{key}")
+        min_priority = cfg.get('min_priority', 4)
+        if not isinstance(min_priority, int) or isinstance(min_priority, bool) or not 1 <= min_priority <= 4:
+            raise ConfigError(f"{name}.min_priority: ожидается число от 1 до 4")
+        unknown = [source for source in cfg.get('sources') or [] if source not in sources]
+        if unknown:
+            raise ConfigError(f"{name}.sources: нет в источниках: {', '.join(unknown)}")
+    return subscribers
+
+@dataclass
+class BotConfig:
+    rss_sources: Dict[str, dict]
+    filters: dict
+    subscribers: List[Subscriber]
+    router: SubscriptionRouter
+    # леммы ключевых слов источников; пусто, пока не загружены модели Natasha
+    source_keywords: Dict[str, List[tuple]] = field(default_factory=dict)
+    # те же ключевые слова для поиска подстрокой, пока лемм нет
+    source_matchers: Dict[str, PhraseMatcher] = field(default_factory=dict)
+    version: int = 1
+
+    def keyword_lists(self) -> Dict[str, List[str]]:
+        return {name: cfg['keywords'] for name, cfg in self.rss_sources.items() if cfg.get('keywords')}
+
+# Доля записей, прошедших ключевые слова своего источника
+def source_keyword_lines() -> List[str]:
+    counts: Dict[str, Dict[str, float]] = {}
+    for (source_name, result), value in SOURCE_KEYWORDS.values.items():
+        counts.setdefault(source_name, {})[result] = value
+    lines = []
+    for source_name, c in sorted(counts.items()):
+        passed, total = c.get('pass', 0), c.get('pass', 0) + c.get('reject', 0)
+        lines.append(f"{source_name}: пропущено {passed:.0f} из {total:.0f} ({passed / max(total, 1):.0%})")
+    return lines
 
 class RussianMarketNewsBot:
     def __init__(self, bot_token: str, chat_id: str):
         self.bot_token = bot_token
         self.chat_id = chat_id
-        self.seen_news: Set[str] = set()
+        self.seen_news: SeenStore = create_seen_store()
+        self.feed_cache = FeedCache()
+        self.mirror_health = MirrorHealth()
+        try:
+            outbox = Outbox()
+        except Exception as e:
+            logging.error(f"Не удалось открыть очередь исходящих {OUTBOX_DB_PATH}: {e}. Неотправленное не сохранится")
+            outbox = None
+        self.delivery = DeliveryQueue(bot_token, outbox)
+        self.archive: Optional[NewsArchive] = None
+        if ARCHIVE_DB_PATH:
+            try:
+                self.archive = NewsArchive()
+            except Exception as e:
+                logging.error(f"Не удалось открыть архив новостей {ARCHIVE_DB_PATH}: {e}. Архив отключён")
+        self.schedules: Dict[str, SourceSchedule] = {}
+        self.feed_parser = BatchExecutor('feeds', parse_feeds, pools.parse)
+        self.story_index: Optional[StoryIndex] = StoryIndex() if DUPLICATE_DETECTION else None
+        DELIVERY_QUEUE_DEPTH.callback = lambda: {(): len(self.delivery)}
+        MIRRORS_OPEN.callback = lambda: {(): sum(1 for url in self.mirror_health.urls if self.mirror_health.is_open(url))}
         self.is_running = False
         self.config_file = "rss_sources.json"
         self.filter_file = "news_filters.json"
         
-        self.rss_sources = self.load_sources()
-        self.filters = self.load_filters()
+        self.subscribers_file = SUBSCRIBERS_FILE
+        self.base_interval = 120.0
+        self.first_cycle_done = asyncio.Event()
+        self.reload_lock = asyncio.Lock()
+        self.config_mtimes = self.config_file_mtimes()
         
         self.critical_keywords = [
             'ключевая ставка', 'санкции', 'газпром', 'сбербанк', 'лукойл', 'роснефт',
@@ -152,8 +2423,102 @@ class RussianMarketNewsBot:
             'северсталь', 'нлмк', 'новатэк', 'магнит', 'х5',
             'сургутнефтегаз', 'татнефт', 'алроса', 'полюс', 'фосагро'
         ]
+        
+        self.config = self.build_config(self.load_sources(), self.load_filters())
+    
+    # Снимок текущей конфигурации; поля ниже — для чтения
+    @property
+    def rss_sources(self) -> Dict[str, dict]:
+        return self.config.rss_sources
+    
+    @property
+    def filters(self) -> dict:
+        return self.config.filters
+    
+    @property
+    def subscribers(self) -> List[Subscriber]:
+        return self.config.subscribers
+    
+    @property
+    def router(self) -> SubscriptionRouter:
+        return self.config.router
+    
+    @property
+    def source_keywords(self) -> Dict[str, List[tuple]]:
+        return self.config.source_keywords
+    
+    def build_config(self, sources: dict, filters: dict, strict: bool = False, version: int = 1) -> BotConfig:
+        subscribers = self.load_subscribers(sources, filters, strict)
+        config = BotConfig(
+            rss_sources=sources,
+            filters=filters,
+            subscribers=subscribers,
+            router=SubscriptionRouter(subscribers, self.critical_keywords),
+            version=version,
+        )
+        config.source_matchers = {name: PhraseMatcher(words) for name, words in config.keyword_lists().items()}
+        return config
     
-    def load_sources(self):
+    def config_file_mtimes(self) -> tuple:
+        mtimes = []
+        for path in (self.config_file, self.filter_file, self.subscribers_file):
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+    
+    # Перечитывает конфиги и подменяет снимок. Сборка идёт вне event loop;
+    # при ошибке в любом файле остаётся старая конфигурация
+    async def reload_config(self) -> BotConfig:
+        async with self.reload_lock:
+            loop = asyncio.get_running_loop()
+            mtimes = self.config_file_mtimes()
+            version = self.config.version + 1
+            config = await loop.run_in_executor(
+                None, lambda: self.build_config(self.load_sources(strict=True), self.load_filters(strict=True), True, version)
+            )
+            if nlp.ready:
+                config.source_keywords = await loop.run_in_executor(pools.nlp(), compile_keyword_lists, config.keyword_lists())
+            old = self.config
+            self.config = config
+            self.config_mtimes = mtimes
+            self.apply_schedules(config)
+            old_keywords = old.keyword_lists()
+            self.recheck_keyword_sources(
+                config, [name for name, words in config.keyword_lists().items() if old_keywords.get(name) != words]
+            )
+            added = config.rss_sources.keys() - old.rss_sources.keys()
+            removed = old.rss_sources.keys() - config.rss_sources.keys()
+            logging.info(
+                f"🔄 Конфигурация v{config.version}: источников {len(config.rss_sources)} "
+                f"(+{len(added)} −{len(removed)}), подписчиков {len(config.subscribers)}"
+            )
+            return config
+    
+    # Расписания живут дольше снимка: у изменённых источников границы
+    # пересчитываются на месте, выключенные и удалённые убираются
+    def apply_schedules(self, config: BotConfig):
+        for source_name in list(self.schedules):
+            source_config = config.rss_sources.get(source_name)
+            if source_config is None or not source_config.get('enabled', True):
+                del self.schedules[source_name]
+            else:
+                self.schedules[source_name].reconfigure(source_config, self.base_interval)
+    
+    async def watch_config(self):
+        while True:
+            await asyncio.sleep(CONFIG_WATCH_INTERVAL_SEC)
+            if self.config_file_mtimes() == self.config_mtimes:
+                continue
+            try:
+                await self.reload_config()
+            except Exception as e:
+                # Не перечитываем битый файл каждые N секунд — ждём следующего изменения
+                self.config_mtimes = self.config_file_mtimes()
+                logging.error(f"❌ Конфигурация не перезагружена, работаю со старой: {e}")
+    
+    def load_sources(self, strict: bool = False):
         default_sources = {
             "Интерфакс": {
                 "url": "https://www.interfax.ru/rss.asp",
@@ -174,12 +2539,44 @@ class RussianMarketNewsBot:
         if os.path.exists(self.config_file):
             try:
                 with open(self.config_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                    return validate_sources(json.load(f))
             except Exception as e:
+                if strict:
+                    raise ConfigError(f"{self.config_file}: {e}") from e
                 logging.error(f"Ошибка загрузки источников: {e}")
                 return default_sources
         return default_sources
     
+    # Фоновая загрузка моделей после первого цикла опроса (или по таймауту)
+    async def load_nlp_models(self):
+        try:
+            await asyncio.wait_for(self.first_cycle_done.wait(), NLP_LOAD_DELAY_SEC)
+        except asyncio.TimeoutError:
+            pass
+        try:
+            await nlp.load_async()
+        except Exception as e:
+            logging.error(f"Не удалось загрузить модели Natasha, лемматизация отключена: {e}")
+            return
+        # Если конфигурацию перезагрузили, пока считались леммы, считаем для нового снимка
+        while True:
+            config = self.config
+            compiled = await asyncio.get_running_loop().run_in_executor(pools.nlp(), compile_keyword_lists, config.keyword_lists())
+            if self.config is config:
+                self.config = replace(config, source_keywords=compiled)
+                # До загрузки моделей записи сверялись по подстроке и могли быть отсеяны зря
+                self.recheck_keyword_sources(self.config, list(compiled))
+                return
+    
+    # Записи, отсеянные ключевыми словами, не попадают в просмотренные, но ETag и
+    # хеш тела ленты уже запомнены — без сброса лента до изменения отвечала бы
+    # «не изменилась». Сбрасываем кеш, чтобы записи проверились по новым правилам
+    def recheck_keyword_sources(self, config: BotConfig, source_names: List[str]):
+        for source_name in source_names:
+            source_config = config.rss_sources.get(source_name)
+            if source_config is not None:
+                self.feed_cache.forget(self.source_urls(source_name, source_config))
+    
     def save_sources(self):
         try:
             with open(self.config_file, 'w', encoding='utf-8') as f:
@@ -187,7 +2584,7 @@ class RussianMarketNewsBot:
         except Exception as e:
             logging.error(f"Ошибка сохранения источников: {e}")
     
-    def load_filters(self):
+    def load_filters(self, strict: bool = False):
         default_filters = {
             'whitelist': [],
             'blacklist': []
@@ -196,8 +2593,10 @@ class RussianMarketNewsBot:
         if os.path.exists(self.filter_file):
             try:
                 with open(self.filter_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                    return validate_filters(json.load(f))
             except Exception as e:
+                if strict:
+                    raise ConfigError(f"{self.filter_file}: {e}") from e
                 logging.error(f"Ошибка загрузки фильтров: {e}")
                 return default_filters
         return default_filters
@@ -209,36 +2608,42 @@ class RussianMarketNewsBot:
         except Exception as e:
             logging.error(f"Ошибка сохранения фильтров: {e}")
     
-    def calculate_priority(self, title: str, description: str, source_priority: int) -> int:
-        text = f"{title} {description}".lower()
-        
-        for keyword in self.critical_keywords:
-            if keyword in text:
-                return 1
-        
-        for company in self.tracked_companies:
-            if company in text:
-                return min(source_priority, 2)
-        
-        return source_priority
-    
-    def apply_filters(self, title: str) -> bool:
-        title_lower = title.lower()
-        
-        if self.filters['whitelist']:
-            if not any(word.lower() in title_lower for word in self.filters['whitelist']):
-                return False
-        
-        if self.filters['blacklist']:
-            if any(word.lower() in title_lower for word in self.filters['blacklist']):
-                return False
-        
-        return True
+    # subscribers.json: {"имя": {"chat_id": ..., "whitelist": [...], "blacklist": [...],
+    # "tracked_companies": [...], "min_priority": 3, "sources": [...]}}. Без файла — один
+    # подписчик TELEGRAM_CHAT_ID с фильтрами из news_filters.json
+    def load_subscribers(self, sources: dict, filters: dict, strict: bool = False) -> List[Subscriber]:
+        subscribers = []
+        if os.path.exists(self.subscribers_file):
+            try:
+                with open(self.subscribers_file, 'r', encoding='utf-8') as f:
+                    for name, cfg in validate_subscribers(json.load(f), sources).items():
+                        if not cfg.get('enabled', True):
+                            continue
+                        subscribers.append(Subscriber(
+                            name=name,
+                            chat_id=str(cfg['chat_id']),
+                            whitelist=cfg.get('whitelist') or [],
+                            blacklist=cfg.get('blacklist') or [],
+                            tracked_companies=cfg['tracked_companies'] if cfg.get('tracked_companies') is not None else self.tracked_companies,
+                            min_priority=cfg.get('min_priority', 4),
+                            sources=cfg.get('sources'),
+                        ))
+            except Exception as e:
+                if strict:
+                    raise ConfigError(f"{self.subscribers_file}: {e}") from e
+                logging.error(f"Ошибка загрузки подписчиков: {e}")
+                subscribers = []
+        if not subscribers and self.chat_id:
+            subscribers.append(Subscriber(
+                name='default',
+                chat_id=str(self.chat_id),
+                whitelist=filters.get('whitelist', []),
+                blacklist=filters.get('blacklist', []),
+                tracked_companies=self.tracked_companies,
+            ))
+        return subscribers
     
-    async def fetch_rss_feed(self, session: aiohttp.ClientSession, source_name: str, source_config: dict) -> List[NewsItem]:
-        if not source_config.get('enabled', True):
-            return []
-        
+    def source_urls(self, source_name: str, source_config: dict) -> List[str]:
         urls: List[str] = []
         main_url = source_config.get('url')
         if main_url:
@@ -259,127 +2664,444 @@ class RussianMarketNewsBot:
             for m in build_dynamic_mirrors(main_url, source_name):
                 if m not in urls:
                     urls.append(m)
-        
+        return urls
+    
+    # Загрузка одного URL с повторами. Возвращает (url, тело, заголовки) или (url, None, None) при 304
+    async def _download(self, session: aiohttp.ClientSession, source_name: str, url: str):
         last_error = None
-        tried_any_success = False
-        for url in urls:
-            for attempt in range(1, MAX_FETCH_RETRIES + 1):
-                try:
-                    timeout = aiohttp.ClientTimeout(total=30)
-                    async with session.get(url, timeout=timeout) as response:
-                        status = response.status
-                        if status == 200:
-                            content = await response.text()
-                            feed = feedparser.parse(content)
-                            news_items = []
-                            # если текущий URL не равен основному, считаем, что это зеркало
-                            is_mirror_feed = (main_url is not None and url != main_url) or ("news.google.com" in url)
-                            for entry in feed.entries[:10]:
-                                try:
-                                    title = entry.get('title', '')
-                                    link = entry.get('link', '')
-                                    description = entry.get('description', '')
-                                    if not title or not link:
-                                        continue
-                                    if not self.apply_filters(title):
-                                        continue
-                                    news_hash = hashlib.md5(link.encode()).hexdigest()
-                                    if news_hash in self.seen_news:
-                                        continue
-                                    published = entry.get('published_parsed')
-                                    if published:
-                                        pub_date = datetime(*published[:6])
-                                        if datetime.now() - pub_date > timedelta(hours=24):
-                                            continue
-                                    else:
-                                        pub_date = datetime.now()
-                                    priority = self.calculate_priority(title, description, source_config.get('priority', 3))
-                                    news_item = NewsItem(
-                                        title=title,
-                                        url=link,
-                                        source=source_name,
-                                        priority=priority,
-                                        category=source_config.get('category', source_name),
-                                        timestamp=pub_date,
-                                        hash=news_hash,
-                                        via_mirror=is_mirror_feed
-                                    )
-                                    self.seen_news.add(news_hash)
-                                    news_items.append(news_item)
-                                except Exception as e:
-                                    logging.error(f"Ошибка обработки новости из {source_name}: {e}")
-                                    continue
-                            tried_any_success = True
-                            return news_items
+        for attempt in range(1, MAX_FETCH_RETRIES + 1):
+            started = time.monotonic()
+            try:
+                headers = self.feed_cache.conditional_headers(url)
+                async with session.get(url, timeout=FEED_REQUEST_TIMEOUT, headers=headers) as response:
+                    status = response.status
+                    FETCH_RESPONSES.inc(source_name, str(status))
+                    if status == 304:
+                        elapsed = time.monotonic() - started
+                        FETCH_SECONDS.observe(elapsed, source_name)
+                        self.mirror_health.record_success(url, elapsed)
+                        return url, None, None
+                    if status == 200:
+                        if STREAMING_PARSE:
+                            body = await self._read_streaming(source_name, url, response)
+                            size = body.bytes_read
                         else:
-                            if status in (404, 406):
-                                logging.warning(f"{source_name}: HTTP {status}. URL: {url}. Попытка {attempt}/{MAX_FETCH_RETRIES}. Пробую альтернативу/повтор…")
-                            elif status in (403, 451):
-                                logging.warning(f"{source_name}: доступ ограничен (HTTP {status}). URL: {url}. Попробую альтернативный источник…")
-                            else:
-                                logging.warning(f"{source_name}: временная ошибка (HTTP {status}). URL: {url}. Попытка {attempt}/{MAX_FETCH_RETRIES}…")
-                            last_error = f"HTTP {status}"
-                except Exception as e:
-                    last_error = str(e)
-                    logging.warning(f"{source_name}: ошибка запроса URL {url} (попытка {attempt}/{MAX_FETCH_RETRIES}): {e}")
-                
-                if attempt < MAX_FETCH_RETRIES:
-                    backoff = BASE_BACKOFF_SEC * (2 ** (attempt - 1))
-                    await asyncio.sleep(backoff)
+                            body = await response.read()
+                            size = len(body)
+                        elapsed = time.monotonic() - started
+                        FETCH_SECONDS.observe(elapsed, source_name)
+                        FETCH_BYTES.inc(source_name, value=size)
+                        self.mirror_health.record_success(url, elapsed)
+                        return url, body, response.headers
+                    FETCH_SECONDS.observe(time.monotonic() - started, source_name)
+                    last_error = f"HTTP {status}"
+                    self.mirror_health.record_failure(url, last_error)
+                    if status in (404, 406, 410):
+                        logging.warning(f"{source_name}: HTTP {status}. URL: {url}. Пробую альтернативу…")
+                        break
+                    elif status in (403, 451):
+                        logging.warning(f"{source_name}: доступ ограничен (HTTP {status}). URL: {url}. Попробую альтернативный источник…")
+                        break
+                    else:
+                        logging.warning(f"{source_name}: временная ошибка (HTTP {status}). URL: {url}. Попытка {attempt}/{MAX_FETCH_RETRIES}…")
+            except Exception as e:
+                last_error = str(e) or type(e).__name__
+                FETCH_RESPONSES.inc(source_name, 'error')
+                self.mirror_health.record_failure(url, last_error)
+                logging.warning(f"{source_name}: ошибка запроса URL {url} (попытка {attempt}/{MAX_FETCH_RETRIES}): {last_error}")
+            
+            # Предохранитель сработал — дальше не долбим заведомо мёртвый URL
+            if self.mirror_health.is_open(url):
+                break
+            if attempt < MAX_FETCH_RETRIES:
+                backoff = BASE_BACKOFF_SEC * (2 ** (attempt - 1))
+                await asyncio.sleep(backoff)
+        raise FetchError(last_error or "нет ответа")
+    
+    # Останавливаем чтение ленты на уже виденной или устаревшей записи.
+    # Google News сортирует по релевантности, а не по времени — там только лимит записей
+    def _stream_should_stop(self, entry: dict, url: str, cutoff: tuple) -> bool:
+        if "news.google.com" in url:
+            return False
+        published = entry['published_parsed']
+        if published and published[:6] < cutoff:
+            return True
+        link = entry['link']
+        return bool(link) and link_digest(link) in self.seen_news
+    
+    # Начало тела (STREAM_DIGEST_BYTES) сверяется с кешем лент до разбора:
+    # лента, отданная с 200 без изменений, заново не разбирается
+    async def _read_streaming(self, source_name: str, url: str, response: aiohttp.ClientResponse) -> StreamedFeed:
+        parser = StreamingFeedParser()
+        chunks: List[bytes] = []
+        entries: List[dict] = []
+        size = 0
+        parse_time = 0.0
+        cutoff = stale_cutoff()
+        stream = response.content.iter_chunked(STREAM_CHUNK_SIZE)
+        async for chunk in stream:
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= STREAM_DIGEST_BYTES:
+                break
+        prefix = b''.join(chunks)[:STREAM_DIGEST_BYTES]
+        if self.feed_cache.same_body(url, prefix):
+            size += await self._drain(response)
+            return StreamedFeed([], prefix, size, unchanged=True)
+
+        def feed(chunk: bytes) -> bool:
+            nonlocal parse_time
+            started = time.perf_counter()
+            parsed = parser.feed(chunk)
+            parse_time += time.perf_counter() - started
+            for entry in parsed:
+                if self._stream_should_stop(entry, url, cutoff):
+                    return True
+                entries.append(entry)
+                if len(entries) >= FEED_MAX_ENTRIES:
+                    return True
+            return False
+
+        try:
+            done = feed(b''.join(chunks))
+            if not done:
+                async for chunk in stream:
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if feed(chunk):
+                        done = True
+                        break
+            if done:
+                size += await self._drain(response)
+            else:
+                for entry in parser.close():
+                    if len(entries) >= FEED_MAX_ENTRIES or self._stream_should_stop(entry, url, cutoff):
+                        break
+                    entries.append(entry)
+            PARSE_SECONDS.observe(parse_time, source_name)
+            return StreamedFeed(entries, prefix, size, complete=not done)
+        except ET.ParseError as e:
+            # Не XML (HTML-страница, битые сущности) — дочитываем и отдаём feedparser
+            logging.info(f"{source_name}: {url} не разбирается потоково ({e}), разбираю целиком")
+            rest = await response.content.read()
+            body = b''.join(chunks) + rest
+            entries = await self.parse_entries(source_name, body, response.headers)
+            return StreamedFeed(entries, prefix, len(body), complete=True, fallback=True)
+    
+    @staticmethod
+    async def _drain(response: aiohttp.ClientResponse) -> int:
+        drained = 0
+        while drained < STREAM_DRAIN_BYTES and not response.content.at_eof():
+            chunk = await response.content.read(min(STREAM_CHUNK_SIZE, STREAM_DRAIN_BYTES - drained))
+            if not chunk:
+                break
+            drained += len(chunk)
+        return drained
+    
+    # Гонка зеркал: если текущий URL не ответил за время хеджирования,
+    # параллельно запускаем следующий; побеждает первый успешный ответ
+    async def _fetch_first(self, session: aiohttp.ClientSession, source_name: str, urls: List[str]):
+        pending: Set[asyncio.Task] = set()
+        queue = list(urls)
+        current = None
+        last_error = None
+        try:
+            while queue or pending:
+                if queue and not pending:
+                    current = queue.pop(0)
+                    pending.add(asyncio.create_task(self._download(session, source_name, current)))
+                hedge = self.mirror_health.hedge_delay(current) if queue else None
+                done, pending = await asyncio.wait(pending, timeout=hedge, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    logging.info(f"{source_name}: {current} не ответил за {hedge:.1f} с, параллельно пробую {queue[0]}")
+                    current = queue.pop(0)
+                    pending.add(asyncio.create_task(self._download(session, source_name, current)))
+                    continue
+                for task in done:
+                    try:
+                        return task.result()
+                    except Exception as e:
+                        last_error = str(e)
+            raise FetchError(last_error or "нет доступных URL")
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    async def parse_entries(self, source_name: str, body: bytes, response_headers) -> List[dict]:
+        with PARSE_SECONDS.time(source_name):
+            return await self.feed_parser.submit((body, {k.lower(): v for k, v in response_headers.items()}))
+    
+    async def parse_feed(self, source_name: str, source_config: dict, url: str, body: bytes, response_headers,
+                         config: Optional[BotConfig] = None) -> List[NewsItem]:
+        entries = await self.parse_entries(source_name, body, response_headers)
+        self.observe_published(source_name, entries)
+        entries = await self.match_source_keywords(source_name, entries, config)
+        with FILTER_SECONDS.time(source_name):
+            return self.select_entries(source_name, source_config, url, entries, config)
+    
+    # Частота публикаций для расписания: свежие записи с непросмотренными
+    # ссылками, ещё до ключевых слов и фильтров подписчиков
+    def observe_published(self, source_name: str, entries: List[dict]):
+        sched = self.schedules.get(source_name)
+        if sched is None or not entries:
+            return
+        cutoff = stale_cutoff()
+        digests = []
+        for entry in entries:
+            link, published = entry['link'], entry['published_parsed']
+            if not link or (published and published[:6] < cutoff):
+                continue
+            digest = link_digest(link)
+            if digest not in self.seen_news:
+                digests.append(digest)
+        sched.observe(digests)
+    
+    # Ключевые слова источника (keywords в rss_sources.json) отсекают записи общих
+    # лент до фильтров подписчиков, приоритета, склейки и доставки. Сравнение по
+    # леммам заголовка с синонимами; пока модели Natasha грузятся — по подстроке.
+    # Отсеянные записи не попадают в просмотренные и будут проверены снова
+    async def match_source_keywords(self, source_name: str, entries: List[dict],
+                                    config: Optional[BotConfig] = None) -> List[dict]:
+        config = config or self.config
+        matcher = config.source_matchers.get(source_name)
+        if matcher is None or not entries:
+            return entries
+        compiled = config.source_keywords.get(source_name)
+        titles = [entry['title'] for entry in entries]
+        # Записи без заголовка пропускаем дальше — их учтёт select_entries как incomplete
+        if compiled is not None and lemmatizer.ready:
+            lemma_sets = await lemmatizer.alemmatize_batch(titles)
+            keep = [not title or Lemmatizer.match(lemmas, compiled) for title, lemmas in zip(titles, lemma_sets)]
+        else:
+            keep = [not title or matcher.match(title) for title in titles]
+        kept = [entry for entry, ok in zip(entries, keep) if ok]
+        rejected = len(entries) - len(kept)
+        if kept:
+            SOURCE_KEYWORDS.inc(source_name, 'pass', value=len(kept))
+        if rejected:
+            SOURCE_KEYWORDS.inc(source_name, 'reject', value=rejected)
+            ITEMS.inc(source_name, 'keywords', value=rejected)
+        return kept
+    
+    # Дешёвые отсечения идут первыми: пустые поля, возраст (сравнение кортежей
+    # без datetime), просмотренные (16 байт md5 ссылки) — и только потом
+    # ключевые слова, маршруты и NewsItem для оставшихся
+    def select_entries(self, source_name: str, source_config: dict, url: str, entries,
+                       config: Optional[BotConfig] = None) -> List[NewsItem]:
+        router = (config or self.config).router
+        main_url = source_config.get('url')
+        # если текущий URL не равен основному, считаем, что это зеркало
+        is_mirror_feed = (main_url is not None and url != main_url) or ("news.google.com" in url)
+        source_priority = source_config.get('priority', 3)
+        category = source_config.get('category', source_name)
+        cutoff = stale_cutoff()
+        seen_news = self.seen_news
+        md5 = hashlib.md5
+        fresh: Set[bytes] = set()
+        incomplete = stale = seen = filtered = 0
+        news_items = []
+        for entry in entries:
+            try:
+                title = entry['title']
+                link = entry['link']
+                if not title or not link:
+                    incomplete += 1
+                    continue
+                published = entry['published_parsed']
+                if published and published[:6] < cutoff:
+                    stale += 1
+                    continue
+                news_hash = md5(link.encode()).digest()
+                if news_hash in fresh or news_hash in seen_news:
+                    seen += 1
+                    continue
+                accepted = router.accepts(title, source_name)
+                routes = router.route(title, entry['description'], source_name, source_priority, accepted) if accepted else None
+                if not routes:
+                    # не прошла фильтры или ни одному чату не подходит по минимальному приоритету
+                    filtered += 1
+                    continue
+                news_items.append(NewsItem(
+                    title, link, source_name, min(routes.values()), category,
+                    datetime(*published[:6]) if published else datetime.now(),
+                    news_hash, is_mirror_feed, routes,
+                ))
+                fresh.add(news_hash)
+            except Exception as e:
+                logging.error(f"Ошибка обработки новости из {source_name}: {e}")
+                continue
+        if fresh:
+            seen_news.add_many(fresh)
+        for stage, count in (('incomplete', incomplete), ('stale', stale), ('seen', seen),
+                             ('filtered', filtered), ('accepted', len(news_items))):
+            if count:
+                ITEMS.inc(source_name, stage, value=count)
+        lookups = seen + filtered + len(news_items)
+        if seen:
+            DEDUP_LOOKUPS.inc('hit', value=seen)
+        if lookups > seen:
+            DEDUP_LOOKUPS.inc('miss', value=lookups - seen)
+        return news_items
+    
+    async def fetch_rss_feed(self, session: aiohttp.ClientSession, source_name: str, source_config: dict,
+                             config: Optional[BotConfig] = None) -> List[NewsItem]:
+        if not source_config.get('enabled', True):
+            return []
         
-        if not tried_any_success:
-            tried_list = ", ".join(urls) if urls else "<пусто>"
-            logging.error(f"{source_name}: не удалось получить ленту после всех попыток. Последняя ошибка: {last_error}. Пробованные URL: {tried_list}")
-        return []
+        urls = self.source_urls(source_name, source_config)
+        ranked = self.mirror_health.rank(urls)
+        try:
+            url, body, headers = await self._fetch_first(session, source_name, ranked)
+        except FetchError as e:
+            tried_list = ", ".join(ranked) if ranked else "<пусто>"
+            skipped = len(urls) - len(ranked)
+            skipped_note = f" Пропущено URL с открытым предохранителем: {skipped}." if skipped else ""
+            logging.error(f"{source_name}: не удалось получить ленту после всех попыток. Последняя ошибка: {e}. Пробованные URL: {tried_list}.{skipped_note}")
+            return []
+        
+        if body is None:
+            # Лента не изменилась — новых записей нет
+            self.feed_cache.record_not_modified(source_name)
+            return []
+        if isinstance(body, StreamedFeed):
+            STREAM_RESULTS.inc(source_name, body.outcome)
+            if self.feed_cache.check_body(source_name, url, headers, body.prefix):
+                return []
+            self.observe_published(source_name, body.entries)
+            entries = await self.match_source_keywords(source_name, body.entries, config)
+            with FILTER_SECONDS.time(source_name):
+                return self.select_entries(source_name, source_config, url, entries, config)
+        if self.feed_cache.check_body(source_name, url, headers, body):
+            return []
+        return await self.parse_feed(source_name, source_config, url, body, headers, config)
+    
+    # Ставит в очередь новые истории и склеивает дубли уже известных; дубли
+    # дописываются к исходной истории, пока её сообщение ещё в очереди.
+    # Новая история получает свои сообщения сразу, до сравнения следующей
+    # записи — иначе копия из того же опроса ушла бы отдельным сообщением.
+    # Возвращает записи новых историй
+    async def collapse_duplicates(self, news_items: List[NewsItem]) -> List[NewsItem]:
+        if lemmatizer.ready:
+            lemma_sets = await lemmatizer.alemmatize_batch([news.title for news in news_items])
+        else:
+            # Модели ещё грузятся — сравниваем по словам без лемматизации
+            lemma_sets = [frozenset(WORD_RE.findall(news.title.lower())) for news in news_items]
+        fresh = []
+        for news, lemmas in zip(news_items, lemma_sets):
+            tokens = story_tokens(lemmas)
+            signature = self.story_index.signature(tokens)
+            anchors = StoryAnchors.build(news.title, tokens)
+            cluster = self.story_index.match(signature, anchors=anchors)
+            if cluster is None:
+                cluster = self.story_index.add(news, signature, anchors=anchors)
+                cluster.deliveries = self.deliver(news, self.news_routes(news))
+                fresh.append(news)
+                continue
+            DUPLICATES.inc(news.source)
+            logging.info(f"🔁 {news.source}: дубль истории «{cluster.news.title}» ({cluster.news.source})")
+            if news.source not in cluster.sources:
+                cluster.sources.append(news.source)
+            routes = self.news_routes(news)
+            # Чаты, которым прежние копии не достались (другие фильтры), получают эту
+            missing = {chat_id: p for chat_id, p in routes.items() if chat_id not in cluster.deliveries}
+            cluster.deliveries.update(self.deliver(news, missing))
+            if not DUPLICATE_ATTACH_SOURCES:
+                continue
+            for chat_id, (sent, message) in list(cluster.deliveries.items()):
+                if chat_id in missing:
+                    continue
+                # Оставляем копию с наивысшим приоритетом, при равенстве — самую раннюю
+                best, priority = sent, message.priority
+                if routes.get(chat_id, priority) < priority:
+                    best, priority = news, routes[chat_id]
+                also = [source for source in cluster.sources if source != best.source]
+                if self.delivery.update(message, self.format_news_message(replace(best, priority=priority), also), priority):
+                    cluster.deliveries[chat_id] = (best, message)
+        return fresh
+    
+    def news_routes(self, news: NewsItem) -> Dict[str, int]:
+        return news.routes or {self.chat_id: news.priority}
+    
+    # Ставит запись в очередь каждому чату из routes со своим приоритетом
+    def deliver(self, news: NewsItem, routes: Dict[str, int]) -> Dict[str, tuple]:
+        deliveries = {}
+        for chat_id, priority in routes.items():
+            text = self.format_news_message(news if priority == news.priority else replace(news, priority=priority))
+            deliveries[chat_id] = (news, self.delivery.put(chat_id, priority, text))
+        return deliveries
     
-    async def send_telegram_message(self, session: aiohttp.ClientSession, message: str):
+    async def poll_source(self, session: aiohttp.ClientSession, source_name: str, source_config: dict,
+                          config: Optional[BotConfig] = None) -> List[NewsItem]:
         try:
-            url = f"https://api.telegram.org/bot{self.bot_token}/sendMessage"
-            data = {
-                'chat_id': self.chat_id,
-                'text': message,
-                'parse_mode': 'HTML',
-                'disable_web_page_preview': True
-            }
-            
-            async with session.post(url, json=data) as response:
-                if response.status != 200:
-                    logging.error(f"Ошибка отправки в Telegram: {await response.text()}")
-                else:
-                    logging.info(f"✅ Сообщение отправлено")
-                    
-        except Exception as e:
-            logging.error(f"Ошибка отправки сообщения: {e}")
+            with POLL_SECONDS.time(source_name):
+                news_items = await asyncio.wait_for(
+                    self.fetch_rss_feed(session, source_name, source_config, config or self.config), SOURCE_POLL_TIMEOUT_SEC
+                )
+        except asyncio.TimeoutError:
+            logging.error(f"{source_name}: опрос не уложился в {SOURCE_POLL_TIMEOUT_SEC:.0f} с")
+            return []
+        self.seen_news.flush()
+        if self.archive is not None and news_items:
+            self.archive.add(news_items)
+        # Важные первыми: при склейке головой истории становится копия с наивысшим приоритетом
+        news_items.sort(key=lambda news: news.priority)
+        if self.story_index is not None and news_items:
+            news_items = await self.collapse_duplicates(news_items)
+        else:
+            for news in news_items:
+                self.deliver(news, self.news_routes(news))
+        self.delivery.flush()
+        if news_items:
+            logging.info(f"📨 {source_name}: в очередь доставки {len(news_items)}, всего ожидает: {len(self.delivery)}")
+        return news_items
     
+    # Однократный опрос всех источников (без учёта расписания)
     async def check_all_sources(self):
-        # Сессия с общими браузерными заголовками
-        timeout = aiohttp.ClientTimeout(total=40)
-        async with aiohttp.ClientSession(headers=DEFAULT_HEADERS, timeout=timeout) as session:
-            tasks = []
-            for source_name, source_config in self.rss_sources.items():
-                tasks.append(self.fetch_rss_feed(session, source_name, source_config))
-            
-            all_results = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            all_news = []
-            for result in all_results:
-                if isinstance(result, list):
-                    all_news.extend(result)
-            
-            all_news.sort(key=lambda x: x.priority)
-            
-            for news in all_news:
-                if not self.is_running:
-                    break
-                message = self.format_news_message(news)
-                await self.send_telegram_message(session, message)
-                
-                if news.priority == 1:
-                    await asyncio.sleep(0.5)
-                else:
-                    await asyncio.sleep(2)
+        session = http.feeds()
+        tasks = []
+        config = self.config
+        for source_name, source_config in config.rss_sources.items():
+            tasks.append(self.poll_source(session, source_name, source_config, config))
+        
+        with CYCLE_SECONDS.time():
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self.first_cycle_done.set()
+        self.end_cycle()
+    
+    # Периодическое обслуживание: сохранение кешей и вытеснение устаревших хешей
+    def end_cycle(self):
+        evicted = self.seen_news.evict_expired()
+        if evicted:
+            logging.info(f"🧹 Удалено устаревших хешей новостей: {evicted}")
+        self.delivery.flush()
+        self.feed_cache.save()
+        self.mirror_health.save()
+        logging.info(f"🗂️ Кеш лент: {self.feed_cache_summary()}")
+    
+    def schedule_summary(self) -> str:
+        parts = []
+        for source_name, sched in self.schedules.items():
+            parts.append(f"{source_name}: {sched.interval:.0f}с ({sched.new_items} нов. за {sched.polls} опр.)")
+        return "; ".join(parts) if parts else "нет данных"
     
-    def format_news_message(self, news: NewsItem) -> str:
+    async def _run_scheduled_poll(self, session: aiohttp.ClientSession, source_name: str, source_config: dict,
+                                  sched: SourceSchedule, config: BotConfig):
+        started = time.monotonic()
+        try:
+            await self.poll_source(session, source_name, source_config, config)
+        except Exception as e:
+            logging.error(f"{source_name}: ошибка опроса: {e}")
+        finally:
+            sched.record(time.monotonic() - started)
+            sched.in_flight = False
+    
+    def feed_cache_summary(self) -> str:
+        parts = []
+        for source_name, c in self.feed_cache.stats.items():
+            parts.append(f"{source_name}: 304={c['not_modified']} same={c['unchanged']} miss={c['miss']}")
+        return "; ".join(parts) if parts else "нет данных"
+
+    def format_news_message(self, news: NewsItem, also_sources: Optional[List[str]] = None) -> str:
         priority_emoji = {1: '🚨', 2: '⚡', 3: '📊', 4: '📰'}
         category_emoji = {
             'ЦБ РФ': '🏦',
@@ -404,6 +3126,8 @@ class RussianMarketNewsBot:
         message += f"{news.title}\n\n"
         message += f"🔗 {news.url}\n"
         message += f"⏰ {samara_time.strftime('%H:%M:%S')}"
+        if also_sources:
+            message += f"\n🔁 Также: {', '.join(also_sources)}"
         
         return message
     
@@ -411,21 +3135,71 @@ class RussianMarketNewsBot:
         logging.info(f"🚀 Запуск мониторинга российского фондового рынка (интервал: {interval_minutes} мин)")
         self.is_running = True
         
-        while self.is_running:
-            try:
-                await self.check_all_sources()
-                logging.info(f"✅ Цикл проверки завершен. Следующая проверка через {interval_minutes} мин.")
-                
-                for _ in range(interval_minutes * 60):
-                    if not self.is_running:
-                        break
-                    await asyncio.sleep(1)
-            except Exception as e:
-                logging.error(f"❌ Ошибка в основном цикле: {e}")
-                await asyncio.sleep(60)
+        # Доставка идёт параллельно опросу, в собственном пуле соединений
+        delivery_task = asyncio.create_task(self.delivery.run(http.telegram()))
+        try:
+            await self._monitoring_loop(interval_minutes)
+        finally:
+            self.delivery.stop()
+            await asyncio.gather(delivery_task, return_exceptions=True)
+    
+    async def _monitoring_loop(self, interval_minutes: int):
+        base_interval = interval_minutes * 60
+        self.base_interval = base_interval
+        tasks: Set[asyncio.Task] = set()
+        next_maintenance = time.monotonic() + base_interval
+        # Проход: с его начала каждый включённый источник опрошен хотя бы раз (newsbot_cycle_seconds)
+        cycle_started = time.monotonic()
+        cycle_polls: Dict[str, int] = {}
+        session = http.feeds()
+        try:
+            while self.is_running:
+                try:
+                    now = time.monotonic()
+                    config = self.config
+                    for source_name, source_config in config.rss_sources.items():
+                        if not source_config.get('enabled', True):
+                            continue
+                        sched = self.schedules.get(source_name)
+                        if sched is None:
+                            sched = SourceSchedule.for_source(source_config, base_interval)
+                            self.schedules[source_name] = sched
+                        if sched.in_flight or sched.next_due > now:
+                            continue
+                        sched.in_flight = True
+                        task = asyncio.create_task(self._run_scheduled_poll(session, source_name, source_config, sched, config))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                        
+                    if not self.first_cycle_done.is_set() and self.schedules and all(
+                            s.polls for s in self.schedules.values()):
+                        self.first_cycle_done.set()
+                    
+                    if self.schedules and all(s.polls > cycle_polls.get(name, 0) for name, s in self.schedules.items()):
+                        CYCLE_SECONDS.observe(now - cycle_started)
+                        cycle_started = now
+                        cycle_polls = {name: s.polls for name, s in self.schedules.items()}
+                        
+                    if now >= next_maintenance:
+                        self.end_cycle()
+                        logging.info(f"✅ Расписание опроса: {self.schedule_summary()}")
+                        next_maintenance = now + base_interval
+                        
+                    idle_due = [s.next_due for s in self.schedules.values() if not s.in_flight]
+                    wake_at = min(idle_due + [next_maintenance])
+                    await asyncio.sleep(min(max(wake_at - time.monotonic(), 0.0), 1.0))
+                except Exception as e:
+                    logging.error(f"❌ Ошибка в основном цикле: {e}")
+                    await asyncio.sleep(60)
+        finally:
+            for task in list(tasks):
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.end_cycle()
     
     def stop_monitoring(self):
         self.is_running = False
+        self.delivery.stop()
         logging.info("⏹️ Мониторинг остановлен")
 
 # Построение динамических зеркал на основе домена основного URL
@@ -459,19 +3233,104 @@ async def main():
     chat_id = os.getenv('TELEGRAM_CHAT_ID')
     interval = int(os.getenv('CHECK_INTERVAL_MINUTES', '2'))
     
-    if not bot_token or not chat_id:
-        logging.error("❌ Не указаны TELEGRAM_BOT_TOKEN или TELEGRAM_CHAT_ID в переменных окружения")
+    if not bot_token or not (chat_id or os.path.exists(SUBSCRIBERS_FILE)):
+        logging.error(f"❌ Не указаны TELEGRAM_BOT_TOKEN или TELEGRAM_CHAT_ID (либо {SUBSCRIBERS_FILE}) в переменных окружения")
         return
     
-    # Запуск HTTP сервера для предотвращения засыпания
+    # Запуск HTTP сервера для предотвращения засыпания. Порт открывается до
+    # создания бота (хранилища, очередь, архив): обработчики читают bot, когда
+    # он уже есть, а до того health check сразу отвечает, что бот стартует
     from aiohttp import web
+    bot: Optional[RussianMarketNewsBot] = None
+    
+    def starting():
+        return web.Response(status=503, text="bot is starting")
     
     async def health_check(request):
-        return web.Response(text="✅ Bot is alive and working!")
+        if bot is None:
+            return web.Response(text="✅ Bot is alive and working!\nStarting...")
+        lines = ["✅ Bot is alive and working!", f"NLP: {'ready' if nlp.ready else 'loading'}", f"Config: v{bot.config.version}"]
+        for source_name, c in bot.feed_cache.stats.items():
+            lines.append(
+                f"{source_name}: cache hit {bot.feed_cache.hit_rate(source_name):.0%} "
+                f"(304={c['not_modified']}, same={c['unchanged']}, miss={c['miss']})"
+            )
+        keyword_lines = source_keyword_lines()
+        if keyword_lines:
+            lines.append("")
+            lines.append("Ключевые слова источников:")
+            lines.extend(keyword_lines)
+        lines.append("")
+        lines.append("Соединения:")
+        lines.extend(http.summary_lines())
+        lines.append("")
+        lines.append("Зеркала:")
+        lines.extend(bot.mirror_health.summary_lines())
+        return web.Response(text="\n".join(lines))
+    
+    profiler = LoopProfiler()
+    
+    async def metrics(request):
+        return web.Response(body=METRICS.render().encode(), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+    
+    def is_admin(request) -> bool:
+        return bool(ADMIN_TOKEN) and request.headers.get('X-Admin-Token') == ADMIN_TOKEN
+    
+    # POST /profiling?enabled=1|0 — включить/выключить профилирование event loop
+    async def profiling(request):
+        if request.method == 'POST':
+            if not is_admin(request):
+                return web.Response(status=403, text="forbidden")
+            if request.query.get('enabled', '1') == '1':
+                profiler.start()
+            else:
+                profiler.stop()
+        return web.Response(text=f"profiling: {'on' if profiler.enabled else 'off'}")
+    
+    # GET /search?q=сбербанк&days=7&source=rbc&priority=2&limit=50 (since/until — ISO-дата)
+    async def search(request):
+        if bot is None:
+            return starting()
+        if bot.archive is None:
+            return web.json_response({'error': 'archive disabled'}, status=404)
+        q = request.query
+        try:
+            since = datetime.fromisoformat(q['since']).timestamp() if 'since' in q else None
+            if 'days' in q:
+                since = time.time() - float(q['days']) * 86400
+            until = datetime.fromisoformat(q['until']).timestamp() if 'until' in q else None
+            max_priority = int(q['priority']) if 'priority' in q else None
+            limit = min(max(int(q.get('limit', '50')), 1), 500)
+        except ValueError as e:
+            return web.json_response({'error': str(e)}, status=400)
+        started = time.perf_counter()
+        items = await bot.archive.search(q.get('q', ''), q.get('source'), since, until, max_priority, limit)
+        return web.json_response({
+            'count': len(items),
+            'took_ms': round((time.perf_counter() - started) * 1000, 2),
+            'items': items,
+        }, dumps=lambda obj: json.dumps(obj, ensure_ascii=False))
+    
+    # POST /reload — перечитать источники, фильтры и подписчиков без перезапуска
+    async def reload(request):
+        if not is_admin(request):
+            return web.Response(status=403, text="forbidden")
+        if bot is None:
+            return starting()
+        try:
+            config = await bot.reload_config()
+        except ConfigError as e:
+            return web.Response(status=400, text=f"config error: {e}")
+        return web.Response(text=f"config v{config.version}: sources={len(config.rss_sources)}, subscribers={len(config.subscribers)}")
     
     app = web.Application()
     app.router.add_get('/', health_check)
     app.router.add_get('/health', health_check)
+    app.router.add_get('/metrics', metrics)
+    app.router.add_get('/profiling', profiling)
+    app.router.add_post('/profiling', profiling)
+    app.router.add_post('/reload', reload)
+    app.router.add_get('/search', search)
     
     runner = web.AppRunner(app)
     await runner.setup()
@@ -480,10 +3339,16 @@ async def main():
     site = web.TCPSite(runner, '0.0.0.0', port)
     await site.start()
     logging.info(f"🌐 HTTP сервер запущен на порту {port}")
+    if LOOP_PROFILING:
+        profiler.start()
     
     # Запуск бота
     bot = RussianMarketNewsBot(bot_token, chat_id)
     
+    # Модели Natasha догружаются в фоне, когда сервер уже отвечает и прошёл первый опрос
+    nlp_task = asyncio.create_task(bot.load_nlp_models())
+    watch_task = asyncio.create_task(bot.watch_config()) if CONFIG_WATCH_INTERVAL_SEC > 0 else None
+    
     try:
         await bot.run_monitoring(interval)
     except KeyboardInterrupt:
@@ -491,6 +3356,18 @@ async def main():
         bot.stop_monitoring()
     except Exception as e:
         logging.error(f"❌ Критическая ошибка: {e}")
+    finally:
+        nlp_task.cancel()
+        if watch_task is not None:
+            watch_task.cancel()
+        # Архив дописывает хвост с леммами через пул NLP — закрываем его до пулов
+        if bot.archive is not None:
+            await bot.archive.close()
+        pools.shutdown()
+        await http.close()
+        bot.seen_news.close()
+        if bot.delivery.outbox is not None:
+            bot.delivery.outbox.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
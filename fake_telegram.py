@@ -0,0 +1,96 @@
+# Локальная заглушка Telegram Bot API для проверки доставки без реального бота.
+# Запуск: python fake_telegram.py --port 8081
+# Бот: TELEGRAM_API_URL=http://127.0.0.1:8081 python bot_server.py
+# Полученные сообщения: GET /messages
+import argparse
+import asyncio
+import logging
+import random
+import time
+
+from aiohttp import web
+
+
+class FakeTelegram:
+    def __init__(self, chat_limit_per_min: float = 20, global_limit_per_sec: float = 30,
+                 fail_rate: float = 0.0, latency_ms: float = 0.0, seed: int = 0):
+        self.chat_interval = 60.0 / chat_limit_per_min if chat_limit_per_min > 0 else 0.0
+        self.global_limit = global_limit_per_sec
+        self.fail_rate = fail_rate
+        self.latency = latency_ms / 1000
+        self.rnd = random.Random(seed)
+        self.messages = []
+        self.rejected_429 = 0
+        self.failed_5xx = 0
+        self._chat_next_allowed = {}
+        self._global_window = []
+
+    def _retry_after(self, chat_id: str) -> float:
+        now = time.monotonic()
+        self._global_window = [t for t in self._global_window if now - t < 1.0]
+        if self.global_limit and len(self._global_window) >= self.global_limit:
+            return 1.0
+        # Как у Telegram: лимит на чат считаем по среднему интервалу с небольшим запасом на всплеск
+        allowed = self._chat_next_allowed.get(chat_id, now)
+        if allowed - now > self.chat_interval * 3:
+            return allowed - now - self.chat_interval * 3
+        return 0.0
+
+    async def send_message(self, request: web.Request) -> web.Response:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        data = await request.json()
+        chat_id = str(data.get('chat_id', ''))
+        text = data.get('text', '')
+        if not chat_id or not text:
+            return web.json_response({'ok': False, 'error_code': 400, 'description': 'Bad Request: message text is empty'}, status=400)
+        if self.fail_rate and self.rnd.random() < self.fail_rate:
+            self.failed_5xx += 1
+            return web.json_response({'ok': False, 'error_code': 502, 'description': 'Bad Gateway'}, status=502)
+        retry_after = self._retry_after(chat_id)
+        if retry_after > 0:
+            self.rejected_429 += 1
+            retry = max(int(retry_after + 0.999), 1)
+            return web.json_response({
+                'ok': False, 'error_code': 429,
+                'description': f'Too Many Requests: retry after {retry}',
+                'parameters': {'retry_after': retry},
+            }, status=429)
+        now = time.monotonic()
+        self._global_window.append(now)
+        self._chat_next_allowed[chat_id] = max(self._chat_next_allowed.get(chat_id, now), now) + self.chat_interval
+        message_id = len(self.messages) + 1
+        self.messages.append({'message_id': message_id, 'chat_id': chat_id, 'text': text, 'date': time.time()})
+        logging.info(f"📩 [{chat_id}] {text.splitlines()[0] if text else ''}")
+        return web.json_response({'ok': True, 'result': {'message_id': message_id, 'chat': {'id': chat_id}, 'text': text}})
+
+    async def list_messages(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'messages': self.messages,
+            'rejected_429': self.rejected_429,
+            'failed_5xx': self.failed_5xx,
+        })
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/bot{token}/sendMessage', self.send_message)
+        app.router.add_get('/messages', self.list_messages)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Заглушка Telegram Bot API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--chat-limit', type=float, default=20, help='сообщений в минуту на чат до ответа 429')
+    parser.add_argument('--global-limit', type=float, default=30, help='сообщений в секунду на всех')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='доля ответов 502')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    fake = FakeTelegram(args.chat_limit, args.global_limit, args.fail_rate, args.latency_ms)
+    web.run_app(fake.create_app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,428 @@
+# Офлайн-прогон конвейера «загрузка → фильтр → приоритет → форматирование» на записанных лентах.
+# Запись корпуса:   python replay.py record [--synthetic 20]
+# Прогон:           python replay.py run --rounds 5 --latency-ms 20 --error-rate 0.05
+# Только сервер:    python replay.py serve --port 8082
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+import aiohttp
+from aiohttp import web
+
+from fake_telegram import FakeTelegram
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'feeds')
+MANIFEST = 'manifest.json'
+
+# Даты записей сдвигаем на время, прошедшее с записи, иначе всё отсеется как устаревшее
+DATE_RE = re.compile(rb'(<(pubDate|published|updated|dc:date)>)([^<]+)(</\2>)')
+LINK_RE = re.compile(rb'(<(link|guid)(?: [^>]*)?>)([^<]+)(</\2>)|(<link [^>]*href=")([^"]+)(")')
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss в Linux — килобайты, в macOS — байты
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def shift_dates(body: bytes, offset_sec: float) -> bytes:
+    def repl(m):
+        raw = m.group(3).strip().decode('ascii', 'ignore')
+        try:
+            if m.group(2) == b'pubDate':
+                shifted = format_datetime(datetime.fromtimestamp(parsedate_to_datetime(raw).timestamp() + offset_sec, timezone.utc))
+            else:
+                dt = datetime.fromisoformat(raw.replace('Z', '+00:00'))
+                shifted = datetime.fromtimestamp(dt.timestamp() + offset_sec, dt.tzinfo or timezone.utc).isoformat()
+        except (TypeError, ValueError):
+            return m.group(0)
+        return m.group(1) + shifted.encode() + m.group(4)
+    return DATE_RE.sub(repl, body)
+
+
+# Копия ленты с уникальными ссылками: так корпус можно размножить без попадания в дедупликацию
+def relink(body: bytes, copy: int) -> bytes:
+    suffix = f"#replay-{copy}".encode()
+
+    def repl(m):
+        if m.group(1):
+            return m.group(1) + m.group(3).strip() + suffix + m.group(4)
+        return m.group(5) + m.group(6) + suffix + m.group(7)
+    return LINK_RE.sub(repl, body)
+
+
+def load_manifest(corpus: str) -> dict:
+    with open(os.path.join(corpus, MANIFEST), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(corpus: str, manifest: dict):
+    with open(os.path.join(corpus, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+class FakeFeeds:
+    def __init__(self, corpus: str, copies: int = 1, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 error_rate: float = 0.0, not_modified_rate: float = 1.0, seed: int = 0):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.not_modified_rate = not_modified_rate
+        self.rnd = random.Random(seed)
+        self.feeds = {}
+        self.stats = {'200': 0, '304': 0, '503': 0}
+        manifest = load_manifest(corpus)
+        now = time.time()
+        for name, entry in manifest.items():
+            with open(os.path.join(corpus, entry['file']), 'rb') as f:
+                body = shift_dates(f.read(), now - entry['recorded_at'])
+            for copy in range(copies):
+                feed_name = name if copies == 1 else f"{name}-{copy}"
+                data = body if copies == 1 else relink(body, copy)
+                self.feeds[feed_name] = {
+                    'body': data,
+                    'etag': '"%s"' % hashlib.sha1(data).hexdigest()[:16],
+                    'content_type': entry.get('content_type', 'application/rss+xml'),
+                    'config': entry.get('config', {}),
+                }
+
+    async def serve_feed(self, request: web.Request) -> web.Response:
+        feed = self.feeds.get(request.match_info['name'])
+        if feed is None:
+            raise web.HTTPNotFound()
+        delay = self.latency + (self.rnd.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and self.rnd.random() < self.error_rate:
+            self.stats['503'] += 1
+            return web.Response(status=503, text='Service Unavailable')
+        if request.headers.get('If-None-Match') == feed['etag'] and self.rnd.random() < self.not_modified_rate:
+            self.stats['304'] += 1
+            return web.Response(status=304, headers={'ETag': feed['etag']})
+        self.stats['200'] += 1
+        return web.Response(body=feed['body'], headers={'ETag': feed['etag'], 'Content-Type': feed['content_type']})
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/feeds/{name}', self.serve_feed)
+        app.router.add_get('/mirror/{name}', self.serve_feed)
+        return app
+
+    def sources(self, base_url: str) -> dict:
+        sources = {}
+        for name, feed in self.feeds.items():
+            config = dict(feed['config'])
+            config.update({
+                'url': f"{base_url}/feeds/{name}",
+                'alt_urls': [f"{base_url}/mirror/{name}"],
+                'enabled': True,
+            })
+            config.setdefault('category', name)
+            config.setdefault('priority', 2)
+            sources[name] = config
+        return sources
+
+
+async def start_site(app: web.Application, host: str = '127.0.0.1', port: int = 0):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://{host}:{port}"
+
+
+# Заглушки крутятся в своём потоке и event loop, чтобы не отнимать время у замеряемого конвейера
+class ServerThread:
+    def __init__(self, *apps: web.Application):
+        self.apps = apps
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.runners = []
+
+    def start(self) -> list:
+        self.thread.start()
+        urls = []
+        for app in self.apps:
+            runner, url = asyncio.run_coroutine_threadsafe(start_site(app), self.loop).result()
+            self.runners.append(runner)
+            urls.append(url)
+        return urls
+
+    def stop(self):
+        for runner in self.runners:
+            asyncio.run_coroutine_threadsafe(runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+async def record(args):
+    os.makedirs(args.corpus, exist_ok=True)
+    manifest = {}
+    if args.synthetic:
+        from bench import synthetic_full_rss
+        for i in range(args.synthetic):
+            name = f"synthetic{i}"
+            with open(os.path.join(args.corpus, f"{name}.xml"), 'wb') as f:
+                f.write(synthetic_full_rss(args.items, args.body_kb, seed=i))
+            manifest[name] = {'file': f"{name}.xml", 'recorded_at': time.time(),
+                              'config': {'category': name, 'priority': 1 + i % 3}}
+        save_manifest(args.corpus, manifest)
+        print(f"📼 Синтетический корпус: {len(manifest)} лент в {args.corpus}")
+        return
+
+    with open(args.sources, encoding='utf-8') as f:
+        sources = json.load(f)
+    headers = {'User-Agent': 'Mozilla/5.0 (replay recorder)', 'Accept': 'application/rss+xml, application/xml;q=0.9, */*;q=0.8'}
+    async with aiohttp.ClientSession(headers=headers, timeout=aiohttp.ClientTimeout(total=30)) as session:
+        for name, config in sources.items():
+            if not config.get('enabled', True):
+                continue
+            for url in [config.get('url')] + config.get('alt_urls', []):
+                if not url:
+                    continue
+                try:
+                    async with session.get(url) as response:
+                        if response.status != 200:
+                            print(f"⚠️ {name}: HTTP {response.status} ({url})")
+                            continue
+                        body = await response.read()
+                        content_type = response.headers.get('Content-Type', 'application/rss+xml')
+                except Exception as e:
+                    print(f"⚠️ {name}: {e or type(e).__name__} ({url})")
+                    continue
+                filename = re.sub(r'[^\w.-]', '_', name) + '.xml'
+                with open(os.path.join(args.corpus, filename), 'wb') as f:
+                    f.write(body)
+                config = {k: v for k, v in config.items() if k not in ('url', 'alt_urls', 'enabled')}
+                manifest[name] = {'file': filename, 'url': url, 'recorded_at': time.time(),
+                                  'content_type': content_type, 'config': config}
+                print(f"📼 {name}: {len(body) / 1024:.0f} КБ")
+                break
+    save_manifest(args.corpus, manifest)
+    print(f"Записано лент: {len(manifest)} из {len(sources)}")
+
+
+async def serve(args):
+    fake = FakeFeeds(args.corpus, args.copies, args.latency_ms, args.jitter_ms, args.error_rate, args.not_modified_rate, args.seed)
+    runner, base_url = await start_site(fake.create_app(), args.host, args.port)
+    with open(args.write_sources, 'w', encoding='utf-8') as f:
+        json.dump(fake.sources(base_url), f, ensure_ascii=False, indent=2)
+    print(f"📡 {len(fake.feeds)} лент на {base_url}/feeds/<имя>, конфиг источников: {args.write_sources}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+# Линейная интерполяция между соседними значениями, как numpy.percentile по умолчанию
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    pos = q * (len(values) - 1)
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+# Сырые замеры по этапам: подменяем observe у гистограмм и оборачиваем вызовы на каждую запись
+class StageRecorder:
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, stage: str, value: float):
+        self.samples.setdefault(stage, []).append(value)
+
+    def tap_histogram(self, stage: str, histogram):
+        observe = histogram.observe
+
+        def tapped(value, *label_values):
+            self.add(stage, value)
+            observe(value, *label_values)
+        histogram.observe = tapped
+
+    def wrap(self, stage: str, func):
+        def timed(*a, **kw):
+            started = time.perf_counter()
+            try:
+                return func(*a, **kw)
+            finally:
+                self.add(stage, time.perf_counter() - started)
+        return timed
+
+    def print_table(self):
+        print(f"{'этап':<14} {'вызовов':>8} {'p50, мс':>9} {'p90, мс':>9} {'p99, мс':>9} {'макс, мс':>9}")
+        for stage, values in self.samples.items():
+            print(f"{stage:<14} {len(values):>8} {percentile(values, 0.5) * 1000:>9.3f} {percentile(values, 0.9) * 1000:>9.3f} "
+                  f"{percentile(values, 0.99) * 1000:>9.3f} {max(values) * 1000:>9.3f}")
+
+
+async def run(args):
+    # Состояние бота — во временном каталоге, который удаляется после прогона
+    with tempfile.TemporaryDirectory(prefix='newsbot-replay-') as tmp:
+        await run_in(args, tmp)
+
+
+async def run_in(args, tmp: str):
+    # Доставка без лимитов Telegram, если не задано иное
+    os.environ.update({
+        'SEEN_STORE': 'memory',
+        'OUTBOX_DB_PATH': ':memory:',
+        'FEED_CACHE_PATH': os.path.join(tmp, 'feed_cache.json'),
+        'MIRROR_HEALTH_PATH': os.path.join(tmp, 'mirror_health.json'),
+        'ARCHIVE_DB_PATH': os.path.join(tmp, 'news_archive.sqlite3'),
+    })
+    os.environ.setdefault('SUBSCRIBERS_FILE', os.path.join(tmp, 'subscribers.json'))
+    os.environ.setdefault('TELEGRAM_CHAT_RATE_PER_MIN', '1000000')
+    os.environ.setdefault('TELEGRAM_CHAT_BURST', '1000000')
+    os.environ.setdefault('TELEGRAM_GLOBAL_RATE_PER_SEC', '1000000')
+    import bot_server
+
+    fake_feeds = FakeFeeds(args.corpus, args.copies, args.latency_ms, args.jitter_ms, args.error_rate, args.not_modified_rate, args.seed)
+    telegram = FakeTelegram(chat_limit_per_min=0, global_limit_per_sec=0, latency_ms=args.telegram_latency_ms)
+    servers = ServerThread(fake_feeds.create_app(), telegram.create_app())
+    feeds_url, telegram_url = servers.start()
+
+    recorder = StageRecorder()
+    recorder.tap_histogram('fetch', bot_server.FETCH_SECONDS)
+    recorder.tap_histogram('parse', bot_server.PARSE_SECONDS)
+    recorder.tap_histogram('select', bot_server.FILTER_SECONDS)
+    recorder.tap_histogram('lemmatize', bot_server.LEMMATIZE_SECONDS)
+    recorder.tap_histogram('poll', bot_server.POLL_SECONDS)
+    recorder.tap_histogram('send', bot_server.TELEGRAM_SEND_SECONDS)
+
+    if args.nlp:
+        await bot_server.nlp.load_async()
+    bot = bot_server.RussianMarketNewsBot('replay', 'replay-chat')
+    bot.delivery = bot_server.DeliveryQueue('replay', None, telegram_url)
+    bot.config = bot.build_config(fake_feeds.sources(feeds_url), bot.filters)
+    # Только локальные адреса: встроенные зеркала и Google News ушли бы в сеть
+    bot.source_urls = lambda source_name, source_config: [source_config['url']] + source_config.get('alt_urls', [])
+    bot.router.accepts = recorder.wrap('filter', bot.router.accepts)
+    bot.router.route = recorder.wrap('priority', bot.router.route)
+    bot.format_news_message = recorder.wrap('format', bot.format_news_message)
+
+    # Задержка event loop: насколько позже положенного просыпается спящая корутина
+    async def sample_loop_lag():
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + 0.01
+            await asyncio.sleep(0.01)
+            recorder.add('loop lag', max(loop.time() - expected, 0.0))
+    lag_task = asyncio.create_task(sample_loop_lag())
+
+    items_before = sum(bot_server.ITEMS.values.values())
+    queued = delivered = 0
+    total = 0.0
+    delivery_task = asyncio.create_task(bot.delivery.run(bot_server.http.telegram())) if args.deliver else None
+    for round_no in range(1, args.rounds + 1):
+        if not args.keep_state:
+            bot.seen_news = bot_server.MemorySeenStore()
+            bot.feed_cache.entries.clear()
+            if bot.story_index is not None:
+                bot.story_index = bot_server.StoryIndex()
+        sent_before = bot.delivery.sent
+        queued_before = bot.delivery.queued
+        started = time.perf_counter()
+        await bot.check_all_sources()
+        round_queued = bot.delivery.queued - queued_before
+        if delivery_task is not None:
+            while len(bot.delivery) or bot.delivery.in_flight:
+                await asyncio.sleep(0.001)
+        elapsed = time.perf_counter() - started
+        recorder.add('round', elapsed)
+        total += elapsed
+        queued += round_queued
+        delivered += bot.delivery.sent - sent_before
+        if delivery_task is None:
+            bot.delivery.heap.clear()
+        print(f"раунд {round_no}: {elapsed * 1000:.0f} мс, в очередь: {round_queued}")
+    if delivery_task is not None:
+        bot.delivery.stop()
+        await delivery_task
+
+    lag_task.cancel()
+    processed = int(sum(bot_server.ITEMS.values.values()) - items_before)
+    stages = {}
+    for (_, stage), count in bot_server.ITEMS.values.items():
+        stages[stage] = stages.get(stage, 0) + int(count)
+    print()
+    recorder.print_table()
+    print()
+    print(f"лент: {len(fake_feeds.feeds)}, ответы сервера: {fake_feeds.stats}")
+    print(f"записей обработано: {processed} ({', '.join(f'{k}={v}' for k, v in sorted(stages.items()))})")
+    print(f"пропускная способность: {processed / total:.0f} записей/с, в очередь: {queued} ({queued / total:.0f}/с)")
+    if args.deliver:
+        print(f"доставлено в заглушку Telegram: {delivered} ({len(telegram.messages)} принято, ошибок: {bot.delivery.failed})")
+    print(f"пиковый RSS: {max_rss_mb():.1f} МБ")
+    for line in bot_server.http.summary_lines():
+        print(f"соединения {line}")
+    for line in bot_server.source_keyword_lines():
+        print(f"ключевые слова {line}")
+
+    if bot.archive is not None:
+        await bot.archive.close()
+    bot_server.pools.shutdown()
+    await bot_server.http.close()
+    servers.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Офлайн-прогон конвейера news-бота на записанных лентах')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('record', help='записать ленты из rss_sources.json в корпус')
+    p.add_argument('--sources', default='rss_sources.json')
+    p.add_argument('--synthetic', type=int, default=0, help='вместо сети сгенерировать N синтетических лент')
+    p.add_argument('--items', type=int, default=60, help='записей в синтетической ленте')
+    p.add_argument('--body-kb', type=int, default=2, help='полный текст статьи в синтетической ленте')
+    p.set_defaults(func=record)
+
+    def server_options(p):
+        p.add_argument('--copies', type=int, default=1, help='размножить корпус: N копий каждой ленты с уникальными ссылками')
+        p.add_argument('--latency-ms', type=float, default=0.0)
+        p.add_argument('--jitter-ms', type=float, default=0.0)
+        p.add_argument('--error-rate', type=float, default=0.0, help='доля ответов 503')
+        p.add_argument('--not-modified-rate', type=float, default=1.0, help='вероятность 304 на совпавший ETag')
+        p.add_argument('--seed', type=int, default=0)
+
+    p = sub.add_parser('serve', help='раздавать корпус локально')
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8082)
+    p.add_argument('--write-sources', default='replay_sources.json', help='куда записать конфиг источников для бота')
+    server_options(p)
+    p.set_defaults(func=serve)
+
+    p = sub.add_parser('run', help='прогнать корпус через конвейер и снять замеры')
+    p.add_argument('--rounds', type=int, default=3)
+    p.add_argument('--keep-state', action='store_true', help='не сбрасывать просмотренные и кеш лент между раундами')
+    p.add_argument('--deliver', action='store_true', help='отправлять сообщения в заглушку Telegram')
+    p.add_argument('--telegram-latency-ms', type=float, default=0.0)
+    p.add_argument('--nlp', action='store_true', help='загрузить модели Natasha до прогона')
+    server_options(p)
+    p.set_defaults(func=run)
+
+    for p in sub.choices.values():
+        p.add_argument('--corpus', default=CORPUS_DIR)
+        p.add_argument('-v', '--verbose', action='store_true', help='логи бота')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+    asyncio.run(args.func(args))
+
+
+if __name__ == '__main__':
+    main()